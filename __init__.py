@@ -33,6 +33,8 @@ def register():
         plot.Ecological,
         plot.Parcel,
         plot.ParcelDo,
+        plot.ParcelHarvestLedger,
+        plot.Cron,
         plot.Beneficiaries,
         product.Certification,
         product.Container,
@@ -48,9 +50,11 @@ def register():
         product.Template,
         weighing.WeighingCenter,
         weighing.Weighing,
+        weighing.WeighingDailySummary,
         weighing.WeighingPlantation,
         weighing.WeighingDo,
         weighing.WeighingParcel,
+        weighing.Cron,
         quality.Configuration,
         quality.ConfigurationCompany,
         quality.ProductQualitySample,
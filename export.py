@@ -0,0 +1,68 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""Weighings export
+
+Writes the weighings, or their parcel or beneficiary rows, as CSV or JSON
+lines for business intelligence tools:
+
+    python -m trytond.modules.agronomics.export -d DATABASE weighings.csv
+    python -m trytond.modules.agronomics.export -d DATABASE \\
+        --rows parcel --format jsonl \\
+        --domain '[["state", "in", ["in_analysis", "done"]]]' parcels.jsonl
+
+The weighings are read by chunks in a read-only transaction, so the export
+does not block the weighings and its memory does not grow with their number.
+"""
+import argparse
+import json
+import sys
+
+
+def export(database, user, file, domain, rows, format, chunk_size):
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    with Transaction().start(database, user, readonly=True):
+        Weighing = Pool().get('agronomics.weighing')
+        Weighing.export_weighings(file, domain=domain, rows=rows,
+            format=format, chunk_size=chunk_size)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(description="Export the weighings")
+    parser.add_argument('-c', '--config', dest='configfile')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('-u', '--user', type=int, default=0,
+        help="the id of the user reading the weighings")
+    parser.add_argument('--rows', default='weighing',
+        choices=['weighing', 'parcel', 'beneficiary'])
+    parser.add_argument('--format', default='csv', choices=['csv', 'jsonl'])
+    parser.add_argument('--domain', type=json.loads, default=[],
+        help="the JSON domain of the weighings to export")
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    parser.add_argument('output', nargs='?', default='-',
+        help="the file to write or - for the standard output")
+
+    options = parser.parse_args(args)
+
+    from trytond.config import config
+    config.update_etc(options.configfile)
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    Pool.start()
+    pool = Pool(options.database)
+    with Transaction().start(options.database, 0, readonly=True):
+        pool.init()
+
+    arguments = (options.domain, options.rows, options.format,
+        options.chunk_size)
+    if options.output == '-':
+        export(options.database, options.user, sys.stdout, *arguments)
+    else:
+        with open(options.output, 'w', newline='', encoding='utf-8') as file:
+            export(options.database, options.user, file, *arguments)
+
+
+if __name__ == '__main__':
+    main()
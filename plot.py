@@ -1,10 +1,56 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
-from sql.aggregate import Sum
-from trytond.model import fields, ModelSQL, ModelView
-from trytond.pool import Pool
+import csv
+import logging
+from bisect import bisect_right
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+from itertools import islice
+
+from sql import Column, Literal, Null
+from sql.aggregate import Count, Min, Sum
+from sql.conditionals import Coalesce
+from sql.functions import CurrentTimestamp
+from trytond import backend
+from trytond.cache import Cache
+from trytond.exceptions import UserError
+from trytond.i18n import gettext
+from trytond.model import (fields, Check, Exclude, Index, ModelSQL, ModelView,
+    Unique)
+from trytond.pool import Pool, PoolMeta
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction
 from trytond.wizard import (Wizard, StateView, Button, StateTransition)
 from trytond.pyson import Bool, Eval, If
+from trytond.sql.functions import DateRange
+from trytond.sql.operators import RangeOverlap
+
+logger = logging.getLogger(__name__)
+
+
+def _stored_columns(Model, exclude):
+    "Return the names of the stored fields of the model to copy"
+    exclude = set(exclude) | {
+        'id', 'create_uid', 'create_date', 'write_uid', 'write_date'}
+    return [n for n, f in Model._fields.items()
+        if not hasattr(f, 'set') and n not in exclude]
+
+
+# The keys of the SIGPAC code in order
+SIGPAC_KEYS = ['province', 'municipality', 'aggregate', 'zone', 'polygon',
+    'parcel', 'enclosure']
+# The (column, start, end) positions of the fixed-width SIGPAC files
+SIGPAC_LAYOUT = [
+    ('province', 0, 2),
+    ('municipality', 2, 5),
+    ('aggregate', 5, 8),
+    ('zone', 8, 11),
+    ('polygon', 11, 14),
+    ('parcel', 14, 19),
+    ('enclosure', 19, 24),
+    ('surface', 24, 34),
+    ('plantation', 34, None),
+    ]
 
 
 class Enclosure(ModelSQL, ModelView):
@@ -20,6 +66,225 @@ class Enclosure(ModelSQL, ModelView):
     polygon_sigpac = fields.Numeric('Polygon Sigpac')
     zone_sigpac = fields.Numeric('Zone Sigpac')
     surface_sigpac = fields.Numeric('Surface Sigpac')
+    sigpac_code = fields.Char('Sigpac Code', readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('sigpac_code_unique', Unique(t, t.sigpac_code),
+                'agronomics.msg_enclosure_sigpac_code_unique'),
+            ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        table_h = cls.__table_handler__(module_name)
+        fill_sigpac_code = not table_h.column_exist('sigpac_code')
+
+        super().__register__(module_name)
+
+        if fill_sigpac_code:
+            table = cls.__table__()
+            cursor = Transaction().connection.cursor()
+            cursor.execute(*table.select(table.id,
+                    *[Column(table, k + '_sigpac') for k in SIGPAC_KEYS],
+                    order_by=table.id))
+            codes = {}
+            for row in cursor.fetchall():
+                try:
+                    code = cls.get_sigpac_code(row[1:])
+                except (ValueError, OverflowError):
+                    continue
+                if code and code not in codes:
+                    codes[code] = row[0]
+            for code, id_ in codes.items():
+                cursor.execute(*table.update(
+                        [table.sigpac_code], [code],
+                        where=table.id == id_))
+
+    @staticmethod
+    def get_sigpac_code(keys):
+        """Return the SIGPAC code of the keys in order or None
+
+        Raises ValueError or OverflowError if a key is not an integer.
+        """
+        if any(k is None for k in keys):
+            return
+        codes = []
+        for key in keys:
+            if int(key) != key:
+                raise ValueError(f"{key} is not an integer")
+            codes.append(str(int(key)))
+        return '-'.join(codes)
+
+    @classmethod
+    def validate(cls, enclosures):
+        super().validate(enclosures)
+        for enclosure in enclosures:
+            enclosure.check_sigpac_keys()
+
+    def check_sigpac_keys(self):
+        try:
+            self.get_sigpac_code(
+                [getattr(self, k + '_sigpac') for k in SIGPAC_KEYS])
+        except (ValueError, OverflowError):
+            raise UserError(gettext('agronomics.msg_enclosure_sigpac_keys',
+                    enclosure=self.rec_name))
+
+    @classmethod
+    def on_modification(cls, mode, enclosures, field_names=None):
+        super().on_modification(mode, enclosures, field_names=field_names)
+        if (mode == 'create'
+                or (mode == 'write'
+                    and {k + '_sigpac' for k in SIGPAC_KEYS}
+                    & set(field_names))):
+            to_write = []
+            for enclosure in enclosures:
+                code = cls.get_sigpac_code(
+                    [getattr(enclosure, k + '_sigpac') for k in SIGPAC_KEYS])
+                if code != enclosure.sigpac_code:
+                    to_write.extend(([enclosure], {'sigpac_code': code}))
+            if to_write:
+                cls.write(*to_write)
+
+    @classmethod
+    def import_sigpac(cls, file, format='csv', layout=None, delimiter=';',
+            plantations=None):
+        """Create or update the enclosures of a SIGPAC file
+
+        The file is read line by line and the enclosures are written by
+        chunks keyed by their SIGPAC code. For the csv format, the first line
+        names the columns. For the fixed format, layout is the list of
+        (column, start, end) positions, SIGPAC_LAYOUT by default.
+        The columns are the SIGPAC keys, the surface and the plantation code,
+        which is mapped to its id by the plantations dictionary or else
+        searched by code.
+
+        An empty or missing surface or plantation keeps the current value of
+        an existing enclosure. The keys must be integers and a SIGPAC code
+        repeated in a chunk is reported on its later lines.
+
+        Returns a dictionary with the codes of the created and updated
+        enclosures, the number of unchanged enclosures and the errors by
+        line number.
+        """
+        pool = Pool()
+        Plantation = pool.get('agronomics.plantation')
+        plantation = Plantation.__table__()
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+        assert format in {'csv', 'fixed'}
+
+        if format == 'csv':
+            lines = csv.DictReader(file, delimiter=delimiter)
+        else:
+            lines = ({c: line[s:e] for c, s, e in (layout or SIGPAC_LAYOUT)}
+                for line in file if line.strip())
+        code2plantation = dict(plantations or {})
+        report = {
+            'created': [],
+            'updated': [],
+            'unchanged': 0,
+            'errors': [],
+            }
+        names = [k + '_sigpac' for k in SIGPAC_KEYS] + [
+            'surface_sigpac', 'plantation']
+        in_max = transaction.database.IN_MAX
+        lines = enumerate(lines, 2 if format == 'csv' else 1)
+        while chunk := list(islice(lines, in_max)):
+            rows = {}
+            for number, line in chunk:
+                # csv puts the fields beyond the header under the None key
+                if line.pop(None, None):
+                    report['errors'].append((number, gettext(
+                                'agronomics.msg_enclosure_sigpac_columns',
+                                line=number)))
+                    continue
+                line = {k: (v or '').strip() for k, v in line.items()}
+                try:
+                    keys = [Decimal(line[k]) for k in SIGPAC_KEYS]
+                    code = cls.get_sigpac_code(keys)
+                    surface = line.get('surface')
+                    surface = (Decimal(surface.replace(',', '.'))
+                        if surface else None)
+                except (KeyError, InvalidOperation, ValueError,
+                        OverflowError):
+                    report['errors'].append((number, gettext(
+                                'agronomics.msg_enclosure_sigpac_line',
+                                line=number)))
+                    continue
+                if code in rows:
+                    report['errors'].append((number, gettext(
+                                'agronomics.msg_enclosure_sigpac_duplicate',
+                                line=number, code=code,
+                                other=rows[code][0])))
+                    continue
+                # An empty or missing surface or plantation keeps the current
+                rows[code] = (
+                    number, keys + [surface, line.get('plantation') or None])
+
+            codes = {r[-1] for _, r in rows.values()
+                if r[-1] and r[-1] not in code2plantation}
+            for sub_codes in grouped_slice(codes):
+                cursor.execute(*plantation.select(
+                        plantation.code, plantation.id,
+                        where=plantation.code.in_(list(sub_codes))))
+                code2plantation.update(cursor)
+            for code, (number, row) in list(rows.items()):
+                plantation_code = row[-1]
+                if plantation_code and plantation_code not in code2plantation:
+                    del rows[code]
+                    report['errors'].append((number, gettext(
+                                'agronomics.msg_enclosure_sigpac_plantation',
+                                line=number, plantation=plantation_code)))
+                    continue
+                row[-1] = code2plantation.get(plantation_code)
+
+            existing = {}
+            for sub_codes in grouped_slice(list(rows)):
+                cursor.execute(*table.select(
+                        table.sigpac_code, table.id, table.surface_sigpac,
+                        table.plantation,
+                        where=table.sigpac_code.in_(list(sub_codes))))
+                for code, id_, surface, plantation_id in cursor:
+                    existing[code] = (id_, surface, plantation_id)
+
+            to_create, to_update = [], defaultdict(list)
+            for code, (_, row) in rows.items():
+                if code not in existing:
+                    to_create.append(row + [code])
+                    report['created'].append(code)
+                    continue
+                id_, surface, plantation_id = existing[code]
+                values = {}
+                if row[-2] is not None and row[-2] != surface:
+                    values['surface_sigpac'] = row[-2]
+                if row[-1] is not None and row[-1] != plantation_id:
+                    values['plantation'] = row[-1]
+                if values:
+                    to_update[tuple(sorted(values.items()))].append(id_)
+                    report['updated'].append(code)
+                else:
+                    report['unchanged'] += 1
+
+            columns = [Column(table, n) for n in names] + [
+                table.sigpac_code, table.create_uid, table.create_date]
+            for sub_rows in grouped_slice(
+                    to_create, in_max // len(columns)):
+                cursor.execute(*table.insert(columns,
+                        [r + [transaction.user, CurrentTimestamp()]
+                            for r in sub_rows]))
+            for values, ids in to_update.items():
+                for sub_ids in grouped_slice(ids):
+                    cursor.execute(*table.update(
+                            [Column(table, n) for n, _ in values]
+                            + [table.write_uid, table.write_date],
+                            [v for _, v in values]
+                            + [transaction.user, CurrentTimestamp()],
+                            where=reduce_ids(table.id, sub_ids)))
+        return report
 
 
 class Crop(ModelSQL, ModelView):
@@ -30,12 +295,181 @@ class Crop(ModelSQL, ModelView):
     name = fields.Char('Name', required=True)
     start_date = fields.Date('Start Date', required=True)
     end_date = fields.Date('End Date', required=True)
+    next_crop = fields.Many2One('agronomics.crop', "Next Crop", readonly=True,
+        help="The crop to which the parcels are copied.")
+    parcel_count = fields.Function(fields.Integer("Parcels"),
+        'get_parcel_counts')
+    copied_parcel_count = fields.Function(fields.Integer("Copied Parcels",
+            states={
+                'invisible': ~Eval('next_crop'),
+                }),
+        'get_parcel_counts')
+    _intervals_cache = Cache('agronomics.crop.find_by_date', context=False)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('dates_check', Check(t, t.start_date <= t.end_date),
+                'agronomics.msg_crop_dates'),
+            ('dates_overlap', Exclude(t,
+                    (DateRange(t.start_date, t.end_date, '[]'),
+                        RangeOverlap)),
+                'agronomics.msg_crop_dates_overlap'),
+            ]
+
+    @classmethod
+    def on_modification(cls, mode, crops, field_names=None):
+        super().on_modification(mode, crops, field_names=field_names)
+        cls._intervals_cache.clear()
+
+    @classmethod
+    def _get_intervals(cls):
+        "Return the start dates, end dates and ids of crops by start date"
+        intervals = cls._intervals_cache.get(None)
+        if intervals is None:
+            table = cls.__table__()
+            cursor = Transaction().connection.cursor()
+            cursor.execute(*table.select(
+                    table.start_date, table.end_date, table.id,
+                    order_by=table.start_date))
+            intervals = tuple(zip(*cursor)) or ((), (), ())
+            cls._intervals_cache.set(None, intervals)
+        return intervals
+
+    @classmethod
+    def find_by_date(cls, date):
+        "Return the crop of the date or None"
+        if not date:
+            return
+        start_dates, end_dates, ids = cls._get_intervals()
+        index = bisect_right(start_dates, date) - 1
+        if index >= 0 and date <= end_dates[index]:
+            return cls(ids[index])
+
+    @classmethod
+    def get_parcel_counts(cls, crops, names):
+        pool = Pool()
+        Parcel = pool.get('agronomics.parcel')
+        crop = cls.__table__()
+        parcel = Parcel.__table__()
+        copied = Parcel.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {n: dict.fromkeys([c.id for c in crops], 0) for n in names}
+        for sub_ids in grouped_slice([c.id for c in crops]):
+            where = reduce_ids(parcel.crop, sub_ids)
+            if 'parcel_count' in names:
+                cursor.execute(*parcel.select(
+                        parcel.crop, Count(Literal('*')),
+                        where=where,
+                        group_by=parcel.crop))
+                result['parcel_count'].update(cursor)
+            if 'copied_parcel_count' in names:
+                cursor.execute(*parcel.join(crop,
+                        condition=parcel.crop == crop.id
+                        ).join(copied,
+                        condition=(copied.previous_parcel == parcel.id)
+                        & (copied.crop == crop.next_crop)
+                        ).select(parcel.crop, Count(Literal('*')),
+                        where=where,
+                        group_by=parcel.crop))
+                result['copied_parcel_count'].update(cursor)
+        return result
+
+    def _parcels_to_copy(self, next_crop, parcel_ids=None):
+        "Return the ids of the parcels of the crop not copied to next crop"
+        pool = Pool()
+        Parcel = pool.get('agronomics.parcel')
+        parcel = Parcel.__table__()
+        copied = Parcel.__table__()
+        cursor = Transaction().connection.cursor()
+
+        where = ((parcel.crop == self.id)
+            & ~parcel.id.in_(copied.select(copied.previous_parcel,
+                    where=(copied.crop == next_crop)
+                    & (copied.previous_parcel != Null))))
+        if parcel_ids is not None:
+            where &= reduce_ids(parcel.id, parcel_ids)
+        cursor.execute(*parcel.select(parcel.id,
+                where=where,
+                order_by=parcel.id))
+        return [i for i, in cursor]
 
     def copy_parcels(self, next_crop):
+        """Copy the parcels of the crop to the next crop with their
+        denominations of origin and beneficiaries but not their weighings
+
+        The parcels are copied by chunks in background tasks which commit
+        each chunk, and those already copied to the next crop are skipped,
+        so an interrupted copy can be run again. The progress is shown by
+        the copied parcel count of the crop."""
+        next_crop = int(next_crop)
+        self.__class__.write([self], {'next_crop': next_crop})
+        for sub_ids in grouped_slice(self._parcels_to_copy(next_crop)):
+            self.__class__.__queue__.copy_parcels_chunk(
+                self, next_crop, list(sub_ids))
+
+    def copy_parcels_chunk(self, next_crop, parcel_ids):
+        "Copy the parcel ids of the crop not yet copied to the next crop"
         pool = Pool()
         Parcel = pool.get('agronomics.parcel')
-        parcels = Parcel.search([('crop' ,'=', self.id)])
-        Parcel.copy(parcels, {'crop': next_crop})
+        ParcelDo = pool.get('agronomics.parcel-agronomics.do')
+        Beneficiary = pool.get('agronomics.beneficiary')
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        parcel = Parcel.__table__()
+        new_parcel = Parcel.__table__()
+        copied = Parcel.__table__()
+        parcel_do = ParcelDo.__table__()
+        new_parcel_do = ParcelDo.__table__()
+        beneficiary = Beneficiary.__table__()
+        new_beneficiary = Beneficiary.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        # The chunk may have been copied by a previous run
+        parcel_ids = self._parcels_to_copy(next_crop, parcel_ids)
+        if not parcel_ids:
+            return
+
+        def copy(Model, from_, table, new_table, exclude, values, where):
+            names = _stored_columns(Model, exclude)
+            cursor.execute(*new_table.insert(
+                    [Column(new_table, n) for n in names + list(values)]
+                    + [new_table.create_uid, new_table.create_date],
+                    from_.select(
+                        *[Column(table, n) for n in names], *values.values(),
+                        Literal(transaction.user), CurrentTimestamp(),
+                        where=where)))
+
+        copy(Parcel, parcel, parcel, new_parcel,
+            {'crop', 'previous_parcel'}, {
+                'crop': Literal(next_crop),
+                'previous_parcel': parcel.id,
+                },
+            where=reduce_ids(parcel.id, parcel_ids))
+        copied_parcel = (
+            (copied.crop == next_crop)
+            & reduce_ids(copied.previous_parcel, parcel_ids))
+        copy(ParcelDo,
+            parcel_do.join(copied,
+                condition=parcel_do.parcel == copied.previous_parcel),
+            parcel_do, new_parcel_do, {'parcel'}, {'parcel': copied.id},
+            where=copied_parcel)
+        copy(Beneficiary,
+            beneficiary.join(copied,
+                condition=beneficiary.parcel == copied.previous_parcel),
+            beneficiary, new_beneficiary, {'parcel', 'weighing'}, {
+                'parcel': copied.id,
+                },
+            where=copied_parcel & (beneficiary.weighing == Null))
+
+        cursor.execute(*copied.select(copied.id, where=copied_parcel))
+        HarvestLedger.update_parcels([i for i, in cursor])
+        Parcel._plantation_crop_cache.clear()
+        logger.info("copied %s parcels of crop %s to crop %s",
+            len(parcel_ids), self.id, next_crop)
 
 
 class DenominationOrigin(ModelSQL, ModelView):
@@ -56,6 +490,68 @@ class MaxProductionAllowed(ModelSQL, ModelView):
     variety = fields.Many2One('product.taxon', 'Variety',
         domain=[('rank', '=', 'variety')], required=True)
     max_production = fields.Numeric('Max Production (kg/ha)', required=True)
+    _matrix_cache = Cache(
+        'agronomics.max.production.allowed.matrix', context=False)
+
+    @classmethod
+    def get_matrix(cls):
+        "Return the max production per hectare by crop, variety and DO"
+        matrix = cls._matrix_cache.get(None)
+        if matrix is None:
+            table = cls.__table__()
+            cursor = Transaction().connection.cursor()
+            cursor.execute(*table.select(
+                    table.crop, table.variety, table.denomination_origin,
+                    Min(table.max_production),
+                    group_by=[
+                        table.crop, table.variety,
+                        table.denomination_origin]))
+            matrix = {(crop, variety, do): float(value)
+                for crop, variety, do, value in cursor}
+            cls._matrix_cache.set(None, matrix)
+        return matrix
+
+    @classmethod
+    def get_max_productions(cls, keys):
+        """Return the max production per hectare of the (crop, variety, DO)
+        keys or None"""
+        matrix = cls.get_matrix()
+        return {k: matrix.get(k) for k in keys}
+
+    @classmethod
+    def on_modification(cls, mode, records, field_names=None):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        super().on_modification(mode, records, field_names=field_names)
+        cls._matrix_cache.clear()
+        if (mode == 'create'
+                or (mode == 'write' and {
+                        'crop', 'variety', 'denomination_origin',
+                        'max_production'} & set(field_names))):
+            HarvestLedger.update_crop_varieties(
+                (r.crop.id, r.variety.id) for r in records)
+
+    @classmethod
+    def on_write(cls, records, values):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        callbacks = super().on_write(records, values)
+        if {'crop', 'variety'} & values.keys():
+            pairs = [(r.crop.id, r.variety.id) for r in records]
+            callbacks.append(cls._matrix_cache.clear)
+            callbacks.append(
+                lambda: HarvestLedger.update_crop_varieties(pairs))
+        return callbacks
+
+    @classmethod
+    def on_delete(cls, records):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        callbacks = super().on_delete(records)
+        pairs = [(r.crop.id, r.variety.id) for r in records]
+        callbacks.append(cls._matrix_cache.clear)
+        callbacks.append(lambda: HarvestLedger.update_crop_varieties(pairs))
+        return callbacks
 
 
 class Irrigation(ModelSQL, ModelView):
@@ -82,38 +578,123 @@ class Plantation(ModelSQL, ModelView):
             ])
     plantation_year = fields.Integer("Plantation Year")
     plantation_owner = fields.Many2One('party.party', "Plantation Owner")
-    varieties = fields.Function(fields.Char('Varieties'), 'get_varieties',
+    varieties = fields.Function(fields.Char('Varieties'), 'get_parcel_values',
         searcher='search_varieties')
-    do = fields.Function(fields.Char('DO'), 'get_do', searcher='search_do')
+    do = fields.Function(fields.Char('DO'), 'get_parcel_values',
+        searcher='search_do')
     purchased_quantity = fields.Function(
         fields.Float("Purchased Quantity", digits=(16, 2)),
-        'get_purchased_quantity')
+        'get_parcel_values')
     remaining_quantity = fields.Function(
         fields.Float("Remainig Quantity", digits=(16, 2)),
-        'get_remaining_quantity', searcher='search_remaining_quantity')
+        'get_parcel_values', searcher='search_remaining_quantity')
     product = fields.Function(fields.Many2One('product.template', 'Product'),
-        'get_product', searcher='search_product')
+        'get_parcel_values', searcher='search_product')
     variety = fields.Function(fields.Many2One('product.taxon', 'Variety'),
-        'get_variety', searcher='search_variety')
+        'get_parcel_values', searcher='search_variety')
     ecological = fields.Function(fields.Many2One('agronomics.ecological',
-        'Ecological'), 'get_ecological', searcher='search_variety')
-
-    def get_do(self, name):
-        do = []
-        for y in self.parcels:
-            do += [x.name for x in y.denomination_origin]
-        return ",".join(list(set(do)))
+        'Ecological'), 'get_parcel_values', searcher='search_ecological')
 
-    def get_varieties(self, name):
-        if not self.parcels:
-            return
-        return ', '.join({y.variety.name for y in self.parcels if y.variety})
-
-    def get_purchased_quantity(self, name):
-        return sum([y.purchased_quantity or 0 for y in self.parcels])
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t, (t.code, Index.Equality(cardinality='high'))),
+                Index(t, (t.code, Index.Similarity(
+                            cardinality='high', begin=True))),
+                })
 
-    def get_remaining_quantity(self, name):
-        return sum([y.remaining_quantity or 0 for y in self.parcels])
+    @classmethod
+    def get_parcel_values(cls, plantations, names):
+        pool = Pool()
+        Parcel = pool.get('agronomics.parcel')
+        ParcelDo = pool.get('agronomics.parcel-agronomics.do')
+        DO = pool.get('agronomics.denomination_of_origin')
+        Taxon = pool.get('product.taxon')
+        parcel = Parcel.__table__()
+        first_parcel = Parcel.__table__()
+        parcel_do = ParcelDo.__table__()
+        do = DO.__table__()
+        taxon = Taxon.__table__()
+        cursor = Transaction().connection.cursor()
+
+        ids = [p.id for p in plantations]
+        result = {}
+        for name in names:
+            if name == 'do':
+                result[name] = dict.fromkeys(ids, '')
+            elif name in {'purchased_quantity', 'remaining_quantity'}:
+                result[name] = dict.fromkeys(ids, 0)
+            else:
+                result[name] = dict.fromkeys(ids)
+
+        for sub_ids in grouped_slice(ids):
+            where = reduce_ids(parcel.plantation, sub_ids)
+
+            if 'do' in names:
+                dos = defaultdict(set)
+                query = parcel.join(parcel_do,
+                    condition=parcel_do.parcel == parcel.id
+                    ).join(do, condition=do.id == parcel_do.do
+                    ).select(parcel.plantation, do.name,
+                        where=where, distinct=True)
+                cursor.execute(*query)
+                for plantation_id, do_name in cursor:
+                    dos[plantation_id].add(do_name)
+                for plantation_id, values in dos.items():
+                    result['do'][plantation_id] = ','.join(sorted(values))
+
+            if 'varieties' in names:
+                varieties = {}
+                query = parcel.join(taxon, 'LEFT',
+                    condition=taxon.id == parcel.variety
+                    ).select(parcel.plantation, taxon.name,
+                        where=where, distinct=True)
+                cursor.execute(*query)
+                for plantation_id, variety_name in cursor:
+                    values = varieties.setdefault(plantation_id, set())
+                    if variety_name:
+                        values.add(variety_name)
+                for plantation_id, values in varieties.items():
+                    result['varieties'][plantation_id] = ', '.join(
+                        sorted(values))
+
+            first_names = {'product', 'variety', 'ecological'} & set(names)
+            if first_names:
+                first = parcel.select(
+                    parcel.plantation.as_('plantation'),
+                    Min(parcel.id).as_('parcel'),
+                    where=where,
+                    group_by=parcel.plantation)
+                query = first.join(first_parcel,
+                    condition=first_parcel.id == first.parcel
+                    ).select(first.plantation, first_parcel.product,
+                        first_parcel.variety, first_parcel.ecological)
+                cursor.execute(*query)
+                for plantation_id, product, variety, ecological in cursor:
+                    values = {
+                        'product': product,
+                        'variety': variety,
+                        'ecological': ecological,
+                        }
+                    for name in first_names:
+                        result[name][plantation_id] = values[name]
+
+            quantity_names = (
+                {'purchased_quantity', 'remaining_quantity'} & set(names))
+            if quantity_names:
+                cursor.execute(*parcel.select(parcel.id, parcel.plantation,
+                        where=where))
+                parcel2plantation = dict(cursor)
+                quantities = Parcel.get_quantities(
+                    Parcel.browse(list(parcel2plantation.keys())),
+                    list(quantity_names))
+                for name in quantity_names:
+                    for parcel_id, value in quantities[name].items():
+                        result[name][parcel2plantation[parcel_id]] += (
+                            value or 0)
+        return result
 
     @classmethod
     def search_varieties(cls, name, clause):
@@ -134,83 +715,52 @@ class Plantation(ModelSQL, ModelView):
     def search_do(cls, name, clause):
         pool = Pool()
         DO = pool.get('agronomics.denomination_of_origin')
-        PARCEL_DO = pool.get('agronomics.parcel-agronomics.do')
+        ParcelDo = pool.get('agronomics.parcel-agronomics.do')
         Parcel = pool.get('agronomics.parcel')
 
         do = DO.__table__()
         parcel = Parcel.__table__()
-        parcel_do = PARCEL_DO.__table__()
-        Operator = fields.SQL_OPERATORS[clause[1]]
-        query = parcel.join(parcel_do, condition=parcel.id == parcel_do.parcel)
-        query = query.join(do, condition=parcel_do.do==parcel_do.do)
+        parcel_do = ParcelDo.__table__()
         _, operator, value = clause
-        query = query.select(parcel.plantation)
-        query.where = Operator(do.name, value)
+        Operator = fields.SQL_OPERATORS[operator]
+        parcels = parcel_do.join(do, condition=do.id == parcel_do.do
+            ).select(parcel_do.parcel,
+                where=Operator(do.name, value))
+        query = parcel.select(parcel.plantation,
+            where=parcel.id.in_(parcels))
         return [('id', 'in', query)]
 
     @classmethod
     def search_remaining_quantity(cls, name, clause):
         pool = Pool()
-        PARCEL_DO = pool.get('agronomics.parcel-agronomics.do')
         Parcel = pool.get('agronomics.parcel')
-        Weighing = pool.get('agronomics.weighing-agronomics.parcel')
-        MaxProductionAllowed = pool.get('agronomics.max.production.allowed')
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        plantation = cls.__table__()
         parcel = Parcel.__table__()
-        parcel_do = PARCEL_DO.__table__()
-        weighing = Weighing.__table__()
-        max_production = MaxProductionAllowed.__table__()
+        ledger = HarvestLedger.__table__()
 
         _, operator, value = clause
         Operator = fields.SQL_OPERATORS[operator]
 
-        join1 = weighing.join(parcel, type_='RIGHT',
-            condition=((weighing.parcel==parcel.id) &
-                (weighing.table != True)))
-        join2 = join1.join(parcel_do, type_= 'LEFT',
-            condition=parcel.id==parcel_do.parcel)
-        join3 = join2.join(max_production, type_='LEFT',
-                condition=((max_production.crop == parcel.crop) &
-                    (max_production.variety == parcel.variety)))
-        query2 = join3.select(parcel.plantation,
-            Sum(max_production.max_production*parcel.surface -
-                weighing.netweight).as_('remaining_quantity'),
-            group_by=parcel.plantation)
-        query = query2.select(query2.plantation)
-        query.where = Operator(query2.remaining_quantity, value)
-        return [('id' , 'in', query)]
-
-    def get_product(self, name):
-        if not self.parcels:
-            return
-        product = self.parcels[0].product
-        if not product:
-            return
-        return product.id
+        remaining_quantity = Sum(Coalesce(ledger.remaining_quantity, 0))
+        query = plantation.join(parcel, 'LEFT',
+            condition=parcel.plantation == plantation.id
+            ).join(ledger, 'LEFT',
+            condition=ledger.parcel == parcel.id
+            ).select(plantation.id,
+                group_by=plantation.id,
+                having=Operator(
+                    Coalesce(remaining_quantity, 0), value))
+        return [('id', 'in', query)]
 
     @classmethod
     def search_product(cls, name, clause):
         return [('parcels.product',) + tuple(clause[1:])]
 
-    def get_variety(self, name):
-        if not self.parcels:
-            return
-        variety = self.parcels[0].variety
-        if not variety:
-            return
-        return variety.id
-
     @classmethod
     def search_variety(cls, name, clause):
         return [('parcels.variety',) + tuple(clause[1:])]
 
-    def get_ecological(self, name):
-        if not self.parcels:
-            return
-        ecological = self.parcels[0].ecological
-        if not ecological:
-            return
-        return ecological.id
-
     @classmethod
     def search_ecological(cls, name, clause):
         return [('parcels.ecological',) + tuple(clause[1:])]
@@ -247,7 +797,7 @@ class Parcel(ModelSQL, ModelView):
         'get_producer', searcher='search_producer')
     irrigation = fields.Many2One('agronomics.irrigation', 'Irrigation')
     max_production = fields.Function(fields.Float("Max Production",
-        digits=(16, 2)), 'get_max_production')
+        digits=(16, 2)), 'get_quantities')
     tenure_regime = fields.Char('Teneru Regime')
     beneficiaries = fields.One2Many('agronomics.beneficiary', 'parcel',
         'Beneficiaries')
@@ -256,40 +806,192 @@ class Parcel(ModelSQL, ModelView):
         'parcel', 'Weighings')
     purchased_quantity = fields.Function(
         fields.Float("Purchased Quantity", digits=(16, 2)),
-        'get_purchased_quantity')
+        'get_quantities')
     remaining_quantity = fields.Function(
         fields.Float("Remainig Quantity", digits=(16, 2)),
-        'get_remaining_quantity')
+        'get_quantities')
+    previous_parcel = fields.Many2One('agronomics.parcel', "Previous Parcel",
+        readonly=True,
+        help="The parcel of the previous crop this parcel was copied from.")
+
+    # The cache has an entry per (plantation, crop) pair and is limited by
+    # the [cache] default size, 1024 entries, unless the
+    # agronomics.parcel.find_by_plantation_crop key of the [cache] section
+    # sets a size above the number of plantations weighed in a crop.
+    _plantation_crop_cache = Cache(
+        'agronomics.parcel.find_by_plantation_crop', context=False)
 
-    def get_rec_name(self, name):
-        if self.plantation and self.crop:
-            return self.plantation.code + ' - ' + self.crop.rec_name
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.plantation, Index.Equality()),
+                    (t.crop, Index.Equality())),
+                Index(t,
+                    (t.previous_parcel, Index.Equality()),
+                    (t.crop, Index.Equality())),
+                })
+
+    @classmethod
+    def copy(cls, parcels, default=None):
+        if default is None:
+            default = {}
+        else:
+            default = default.copy()
+        default.setdefault('weighings', None)
+        default.setdefault('previous_parcel', None)
+        return super().copy(parcels, default=default)
+
+    @classmethod
+    def get_rec_name(cls, parcels, name):
+        pool = Pool()
+        Plantation = pool.get('agronomics.plantation')
+        Crop = pool.get('agronomics.crop')
+        parcel = cls.__table__()
+        plantation = Plantation.__table__()
+        crop = Crop.__table__()
+        cursor = Transaction().connection.cursor()
+
+        names = dict.fromkeys([p.id for p in parcels])
+        for sub_ids in grouped_slice(list(names)):
+            cursor.execute(*parcel.join(plantation,
+                    condition=parcel.plantation == plantation.id
+                    ).join(crop, condition=parcel.crop == crop.id
+                    ).select(parcel.id, plantation.code, crop.name,
+                    where=reduce_ids(parcel.id, sub_ids)))
+            for parcel_id, code, crop_name in cursor:
+                names[parcel_id] = code + ' - ' + crop_name
+        return names
 
     @classmethod
     def search_rec_name(cls, name, clause):
+        # Search the plantations and the crops in subqueries so the index
+        # on the plantation code is used
         return ['OR',
-            ('plantation.code',) + tuple(clause[1:]),
-            ('crop.name',) + tuple(clause[1:]),
+            ('plantation', 'where', [('code',) + tuple(clause[1:])]),
+            ('crop', 'where', [('name',) + tuple(clause[1:])]),
             ]
 
     def get_all_do(self, name):
         return ",".join([x.name for x in self.denomination_origin])
 
-    def get_max_production(self, name):
-        MaxProduction = Pool().get('agronomics.max.production.allowed')
-        max_production = MaxProduction.search([('crop', '=', self.crop.id),
-            ('variety', '=', self.variety.id), ('denomination_origin', 'in',
-                self.denomination_origin)])
-        if not max_production:
-            return None
-        return round(float(min([x.max_production for x in max_production])
-            )*self.surface, 2)
+    @classmethod
+    def find_by_plantation_crop(cls, pairs):
+        "Return a dictionary of (plantation id, crop id) to parcel"
+        result = {}
+        missing = set()
+        for key in set(pairs):
+            parcel_id = cls._plantation_crop_cache.get(key, -1)
+            if parcel_id == -1:
+                missing.add(key)
+            else:
+                result[key] = parcel_id
+        if missing:
+            found = dict.fromkeys(missing)
+            # Search in reverse order to keep the first parcel of the
+            # plantation
+            for parcel in cls.search([
+                        ('plantation', 'in', list({p for p, _ in missing})),
+                        ('crop', 'in', list({c for _, c in missing})),
+                        ], order=[('id', 'DESC')]):
+                key = (parcel.plantation.id, parcel.crop.id)
+                if key in found:
+                    found[key] = parcel.id
+            for key, parcel_id in found.items():
+                cls._plantation_crop_cache.set(key, parcel_id)
+            result.update(found)
+        return {k: cls(v) if v is not None else None
+            for k, v in result.items()}
 
-    def get_purchased_quantity(self, name):
-        return sum([(w.netweight or 0) for w in self.weighings if not w.table])
+    @classmethod
+    def compute_quantities(cls, ids):
+        """Return the crop, max production and purchased quantity of the
+        parcel ids computed from max productions allowed and weighings"""
+        pool = Pool()
+        ParcelDo = pool.get('agronomics.parcel-agronomics.do')
+        MaxProduction = pool.get('agronomics.max.production.allowed')
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        parcel = cls.__table__()
+        parcel_do = ParcelDo.__table__()
+        weighing_parcel = WeighingParcel.__table__()
+        cursor = Transaction().connection.cursor()
+
+        matrix = MaxProduction.get_matrix()
+        result = {}
+        for sub_ids in grouped_slice(ids):
+            cursor.execute(*parcel_do.select(
+                    parcel_do.parcel, parcel_do.do,
+                    where=reduce_ids(parcel_do.parcel, sub_ids)))
+            dos = defaultdict(list)
+            for parcel_id, do in cursor:
+                dos[parcel_id].append(do)
+
+            cursor.execute(*parcel.select(
+                    parcel.id, parcel.crop, parcel.variety, parcel.surface,
+                    where=reduce_ids(parcel.id, sub_ids)))
+            for parcel_id, crop, variety, surface in cursor:
+                values = [matrix[k] for k in (
+                        (crop, variety, do) for do in dos[parcel_id])
+                    if k in matrix]
+                value = None
+                if values:
+                    value = round(min(values) * (surface or 0), 2)
+                result[parcel_id] = [crop, value, 0]
+
+            query = weighing_parcel.select(
+                weighing_parcel.parcel,
+                Sum(Coalesce(weighing_parcel.netweight, 0)),
+                where=(reduce_ids(weighing_parcel.parcel, sub_ids)
+                    & ((weighing_parcel.table == Null)
+                        | (weighing_parcel.table == False))),
+                group_by=weighing_parcel.parcel)
+            cursor.execute(*query)
+            for parcel_id, value in cursor:
+                if parcel_id in result:
+                    result[parcel_id][2] = float(value or 0)
+        return {k: tuple(v) for k, v in result.items()}
+
+    @classmethod
+    def get_quantities(cls, parcels, names):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+
+        ids = [p.id for p in parcels]
+        quantities = HarvestLedger.get_quantities(ids)
+        missing = [i for i in ids if i not in quantities]
+        for parcel_id, (_, max_production, purchased_quantity) in (
+                cls.compute_quantities(missing).items()):
+            quantities[parcel_id] = (max_production, purchased_quantity)
+
+        result = {}
+        for name in names:
+            result[name] = {}
+            for parcel_id in ids:
+                max_production, purchased_quantity = quantities.get(
+                    parcel_id, (None, 0))
+                if name == 'max_production':
+                    value = max_production
+                elif name == 'purchased_quantity':
+                    value = purchased_quantity
+                elif name == 'remaining_quantity':
+                    value = (max_production or 0) - (purchased_quantity or 0)
+                result[name][parcel_id] = value
+        return result
 
-    def get_remaining_quantity(self, name):
-        return (self.max_production or 0) - (self.purchased_quantity or 0)
+    @classmethod
+    def on_modification(cls, mode, parcels, field_names=None):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        super().on_modification(mode, parcels, field_names=field_names)
+        if (mode in {'create', 'delete'}
+                or {'plantation', 'crop'} & set(field_names)):
+            cls._plantation_crop_cache.clear()
+        if (mode == 'create'
+                or (mode == 'write'
+                    and {'crop', 'variety', 'surface'} & set(field_names))):
+            HarvestLedger.update_parcels([p.id for p in parcels])
 
     def get_producer(self, name):
         return self.plantation.party
@@ -307,6 +1009,171 @@ class ParcelDo(ModelSQL):
     do = fields.Many2One('agronomics.denomination_of_origin',
         'Denomination Origin')
 
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.parcel, Index.Equality()),
+                (t.do, Index.Equality())))
+
+    @classmethod
+    def on_modification(cls, mode, records, field_names=None):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        super().on_modification(mode, records, field_names=field_names)
+        if (mode == 'create'
+                or (mode == 'write' and {'parcel', 'do'} & set(field_names))):
+            HarvestLedger.update_parcels(
+                [r.parcel.id for r in records if r.parcel])
+
+    @classmethod
+    def on_write(cls, records, values):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        callbacks = super().on_write(records, values)
+        if 'parcel' in values:
+            parcel_ids = [r.parcel.id for r in records if r.parcel]
+            callbacks.append(lambda: HarvestLedger.update_parcels(parcel_ids))
+        return callbacks
+
+    @classmethod
+    def on_delete(cls, records):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        callbacks = super().on_delete(records)
+        parcel_ids = [r.parcel.id for r in records if r.parcel]
+        callbacks.append(lambda: HarvestLedger.update_parcels(parcel_ids))
+        return callbacks
+
+
+class ParcelHarvestLedger(ModelSQL, ModelView):
+    "Parcel Harvest Ledger"
+    __name__ = 'agronomics.parcel.harvest_ledger'
+
+    parcel = fields.Many2One('agronomics.parcel', "Parcel", required=True,
+        readonly=True, ondelete='CASCADE')
+    crop = fields.Many2One('agronomics.crop', "Crop", required=True,
+        readonly=True)
+    max_production = fields.Float("Max Production", digits=(16, 2),
+        readonly=True)
+    purchased_quantity = fields.Float("Purchased Quantity", digits=(16, 2),
+        readonly=True)
+    remaining_quantity = fields.Float("Remaining Quantity", digits=(16, 2),
+        readonly=True)
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_constraints += [
+            ('parcel_crop_unique', Unique(t, t.parcel, t.crop),
+                'agronomics.msg_harvest_ledger_parcel_crop_unique'),
+            ]
+
+    @classmethod
+    def __register__(cls, module_name):
+        pool = Pool()
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        TableHandler = backend.TableHandler
+
+        exist = TableHandler.table_exist(cls._table)
+        super().__register__(module_name)
+
+        # Fill the ledger of the existing parcels
+        if not exist and TableHandler.table_exist(WeighingParcel._table):
+            cls.rebuild()
+
+    @classmethod
+    def get_quantities(cls, parcel_ids):
+        "Return the max production and purchased quantity per parcel id"
+        table = cls.__table__()
+        cursor = Transaction().connection.cursor()
+
+        result = {}
+        for sub_ids in grouped_slice(parcel_ids):
+            cursor.execute(*table.select(
+                    table.parcel, table.max_production,
+                    table.purchased_quantity,
+                    where=reduce_ids(table.parcel, sub_ids)))
+            for parcel_id, max_production, purchased_quantity in cursor:
+                result[parcel_id] = (max_production, purchased_quantity)
+        return result
+
+    @classmethod
+    def update_parcels(cls, parcel_ids):
+        "Recompute the ledger lines of the parcel ids"
+        pool = Pool()
+        Parcel = pool.get('agronomics.parcel')
+        table = cls.__table__()
+        transaction = Transaction()
+        cursor = transaction.connection.cursor()
+
+        for sub_ids in grouped_slice(list(set(parcel_ids))):
+            sub_ids = list(sub_ids)
+            quantities = Parcel.compute_quantities(sub_ids)
+            cursor.execute(*table.delete(
+                    where=reduce_ids(table.parcel, sub_ids)))
+            if not quantities:
+                continue
+            cursor.execute(*table.insert([
+                        table.create_uid, table.create_date,
+                        table.parcel, table.crop, table.max_production,
+                        table.purchased_quantity, table.remaining_quantity,
+                        ], [[
+                            transaction.user, CurrentTimestamp(),
+                            parcel_id, crop, max_production,
+                            purchased_quantity,
+                            (max_production or 0) - purchased_quantity,
+                            ] for parcel_id, (
+                                crop, max_production, purchased_quantity)
+                        in quantities.items()]))
+
+    @classmethod
+    def update_crop_varieties(cls, pairs):
+        "Recompute the ledger lines of the parcels of (crop, variety) pairs"
+        pool = Pool()
+        Parcel = pool.get('agronomics.parcel')
+        parcel = Parcel.__table__()
+        cursor = Transaction().connection.cursor()
+
+        pairs = set(pairs)
+        if not pairs:
+            return
+        cursor.execute(*parcel.select(
+                parcel.id, parcel.crop, parcel.variety,
+                where=(parcel.crop.in_(list({c for c, _ in pairs}))
+                    & parcel.variety.in_(list({v for _, v in pairs})))))
+        cls.update_parcels([parcel_id
+                for parcel_id, crop, variety in cursor
+                if (crop, variety) in pairs])
+
+    @classmethod
+    def rebuild(cls):
+        "Recompute the ledger lines of all the parcels"
+        pool = Pool()
+        Parcel = pool.get('agronomics.parcel')
+        table = cls.__table__()
+        parcel = Parcel.__table__()
+        cursor = Transaction().connection.cursor()
+
+        cursor.execute(*table.delete())
+        cursor.execute(*parcel.select(parcel.id))
+        cls.update_parcels([parcel_id for parcel_id, in cursor])
+
+
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.method.selection.append(
+            ('agronomics.parcel.harvest_ledger|rebuild',
+                "Rebuild Harvest Ledger"),
+            )
+
 
 class Beneficiaries(ModelSQL, ModelView):
     "Beneficiaries"
@@ -0,0 +1,226 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""Weighbridge scale listener
+
+Reads the continuous output of the scale indicators of the weighing centers
+over TCP and sets their stable weights on the draft weighings of the
+centers. A simulator of scale indicators allows to test the listener
+without hardware:
+
+    python -m trytond.modules.agronomics.scale simulate --count 50
+    python -m trytond.modules.agronomics.scale listen -d DATABASE \\
+        --scale 1=localhost:9100 --scale 2=localhost:9101
+
+Without --scale, the scales are read from the host and port of the weighing
+centers.
+"""
+import argparse
+import asyncio
+import logging
+import random
+import re
+
+logger = logging.getLogger(__name__)
+
+# The frames are the status (ST stable, US unstable), the gross or net mode
+# (GS, NT) and the signed weight in kilograms, e.g. "ST,GS,+0012340kg"
+FRAME = re.compile(rb'^(ST|US),(GS|NT),\s*([+-]?\d+(?:\.\d+)?)\s*kg$')
+
+
+def parse_frame(line):
+    "Return the weight of a stable frame or None"
+    match = FRAME.match(line.strip())
+    if match and match.group(1) == b'ST':
+        return float(match.group(3))
+
+
+async def read_scale(center, host, port, queue, min_weight=20, retry=5):
+    """Put on the queue the weights of the scale when they become stable
+
+    A weight is put once until the scale goes back under min_weight or
+    becomes stable on another weight."""
+    while True:
+        try:
+            reader, writer = await asyncio.open_connection(host, port)
+        except OSError as exception:
+            logger.warning(
+                "scale %s at %s:%s: %s", center, host, port, exception)
+            await asyncio.sleep(retry)
+            continue
+        logger.info("scale %s connected to %s:%s", center, host, port)
+        last_weight = None
+        try:
+            while line := await reader.readline():
+                weight = parse_frame(line)
+                if weight is None:
+                    continue
+                if weight < min_weight:
+                    last_weight = None
+                elif weight != last_weight:
+                    last_weight = weight
+                    await queue.put((center, weight))
+        except (OSError, ValueError) as exception:
+            # ValueError is raised for a frame longer than the stream limit
+            logger.warning("scale %s: %s", center, exception)
+        finally:
+            writer.close()
+        await asyncio.sleep(retry)
+
+
+def set_weights(database, user, weights):
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    with Transaction().start(database, user):
+        Weighing = Pool().get('agronomics.weighing')
+        return Weighing.set_scale_weights(weights)
+
+
+async def write_weights(database, user, queue):
+    """Set the weights of the queue on the weighings
+
+    The weights waiting on the queue are written in one transaction unless
+    the same center has many of them."""
+    loop = asyncio.get_running_loop()
+    while True:
+        batches = [dict([await queue.get()])]
+        while not queue.empty():
+            center, weight = queue.get_nowait()
+            if center in batches[-1]:
+                batches.append({})
+            batches[-1][center] = weight
+        for weights in batches:
+            try:
+                ids = await loop.run_in_executor(
+                    None, set_weights, database, user, weights)
+            except Exception:
+                logger.exception("failed to set weights %s", weights)
+            else:
+                logger.info("set weights %s on weighings %s", weights, ids)
+
+
+def get_scales(database):
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    with Transaction().start(database, 0, readonly=True):
+        Center = Pool().get('agronomics.weighing.center')
+        return [(c.id, c.scale_host, c.scale_port)
+            for c in Center.search([
+                    ('scale_host', '!=', None),
+                    ('scale_port', '!=', None),
+                    ])]
+
+
+async def listen(database, user, scales):
+    queue = asyncio.Queue()
+    await asyncio.gather(
+        write_weights(database, user, queue),
+        *(read_scale(center, host, port, queue)
+            for center, host, port in scales))
+
+
+def truck_frames(rate):
+    "Yield the frames of a truck weighed loaded and then empty"
+    tara = random.randrange(6000, 15000, 20)
+    gross = tara + random.randrange(2000, 25000, 20)
+    for weight in [gross, tara]:
+        # Empty scale
+        for _ in range(random.randint(2, 5) * rate):
+            yield 'ST', 0
+        # Driving on the scale
+        for step in range(1, 2 * rate + 1):
+            yield 'US', weight * step // (2 * rate) + random.randint(-60, 60)
+        # Settling
+        for _ in range(rate):
+            yield 'US', weight + random.randrange(-40, 60, 20)
+        # Stable
+        for _ in range(random.randint(3, 6) * rate):
+            yield 'ST', weight
+        # Driving off the scale
+        for step in range(2 * rate - 1, -1, -1):
+            yield 'US', weight * step // (2 * rate) + random.randint(-60, 60)
+
+
+async def simulate_scale(reader, writer, rate=10):
+    "Write the frames of trucks on the weighbridge at rate frames per second"
+    try:
+        while True:
+            for status, weight in truck_frames(rate):
+                writer.write(
+                    ('%s,GS,%+08dkg\r\n' % (status, max(weight, 0)))
+                    .encode())
+                await writer.drain()
+                await asyncio.sleep(1 / rate)
+    except OSError:
+        pass
+    finally:
+        writer.close()
+
+
+async def simulate(host, port, count, rate):
+    servers = []
+    for index in range(count):
+        servers.append(await asyncio.start_server(
+                lambda r, w: simulate_scale(r, w, rate), host, port + index))
+        logger.info("scale simulator on %s:%s", host, port + index)
+    await asyncio.gather(*(s.serve_forever() for s in servers))
+
+
+def parse_scale(value):
+    center, address = value.split('=', 1)
+    host, port = address.rsplit(':', 1)
+    return int(center), host, int(port)
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Weighbridge scale listener and simulator")
+    parser.add_argument('-v', '--verbose', action='store_true')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    listen_parser = subparsers.add_parser('listen')
+    listen_parser.add_argument('-c', '--config', dest='configfile')
+    listen_parser.add_argument('-d', '--database', required=True)
+    listen_parser.add_argument('-u', '--user', type=int, default=0,
+        help="the id of the user writing the weighings")
+    listen_parser.add_argument('--scale', dest='scales', action='append',
+        type=parse_scale, default=[], metavar='CENTER=HOST:PORT')
+
+    simulate_parser = subparsers.add_parser('simulate')
+    simulate_parser.add_argument('--host', default='localhost')
+    simulate_parser.add_argument('--port', type=int, default=9100)
+    simulate_parser.add_argument('--count', type=int, default=1,
+        help="the number of scales on consecutive ports")
+    simulate_parser.add_argument('--rate', type=int, default=10,
+        help="the number of frames per second of each scale")
+
+    options = parser.parse_args(args)
+    logging.basicConfig(
+        level=logging.INFO if options.verbose else logging.WARNING)
+
+    if options.command == 'simulate':
+        coroutine = simulate(
+            options.host, options.port, options.count, options.rate)
+    else:
+        from trytond.config import config
+        config.update_etc(options.configfile)
+        from trytond.pool import Pool
+        from trytond.transaction import Transaction
+
+        Pool.start()
+        pool = Pool(options.database)
+        with Transaction().start(options.database, 0, readonly=True):
+            pool.init()
+        scales = options.scales or get_scales(options.database)
+        if not scales:
+            parser.error("no scale to listen")
+        coroutine = listen(options.database, options.user, scales)
+    try:
+        asyncio.run(coroutine)
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# This file is part of Tryton.  The COPYRIGHT file at the top level of
+# this repository contains the full copyright notices and license terms.
+"""SIGPAC enclosures import
+
+Creates or updates the enclosures of a SIGPAC file with a header line of
+semicolon separated columns or with fixed-width columns:
+
+    python -m trytond.modules.agronomics.sigpac -d DATABASE enclosures.csv
+    python -m trytond.modules.agronomics.sigpac -d DATABASE \\
+        --format fixed enclosures.txt
+
+The enclosures are written by chunks in a single transaction which is
+committed only if no line has errors, unless --partial is set. The errors
+are printed by line number.
+"""
+import argparse
+import sys
+
+
+def import_sigpac(database, user, file, format, delimiter, partial):
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    with Transaction().start(database, user) as transaction:
+        Enclosure = Pool().get('agronomics.enclosure')
+        report = Enclosure.import_sigpac(
+            file, format=format, delimiter=delimiter)
+        if report['errors'] and not partial:
+            transaction.rollback()
+    return report
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description="Import the SIGPAC enclosures")
+    parser.add_argument('-c', '--config', dest='configfile')
+    parser.add_argument('-d', '--database', required=True)
+    parser.add_argument('-u', '--user', type=int, default=0,
+        help="the id of the user writing the enclosures")
+    parser.add_argument('--format', default='csv', choices=['csv', 'fixed'])
+    parser.add_argument('--delimiter', default=';',
+        help="the column delimiter of the csv format")
+    parser.add_argument('--partial', action='store_true',
+        help="write the valid lines even if some lines have errors")
+    parser.add_argument('input', nargs='?', default='-',
+        help="the file to read or - for the standard input")
+
+    options = parser.parse_args(args)
+
+    from trytond.config import config
+    config.update_etc(options.configfile)
+    from trytond.pool import Pool
+    from trytond.transaction import Transaction
+
+    Pool.start()
+    pool = Pool(options.database)
+    with Transaction().start(options.database, 0, readonly=True):
+        pool.init()
+
+    arguments = (options.format, options.delimiter, options.partial)
+    if options.input == '-':
+        report = import_sigpac(
+            options.database, options.user, sys.stdin, *arguments)
+    else:
+        with open(options.input, newline='', encoding='utf-8') as file:
+            report = import_sigpac(
+                options.database, options.user, file, *arguments)
+
+    for number, error in report['errors']:
+        print(f"{number}: {error}", file=sys.stderr)
+    if report['errors'] and not options.partial:
+        print("No enclosure written", file=sys.stderr)
+        return 1
+    print(f"{len(report['created'])} created, "
+        f"{len(report['updated'])} updated, "
+        f"{report['unchanged']} unchanged")
+    return 1 if report['errors'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
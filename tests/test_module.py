@@ -1,14 +1,1654 @@
-
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
+import asyncio
+import csv
+import datetime
+import io
+import json
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from trytond.exceptions import UserError
+from trytond.model.exceptions import SQLConstraintError
+from trytond.modules.account.tests import create_chart
+from trytond.modules.agronomics import plot, scale
+from trytond.modules.company.tests import (
+    CompanyTestMixin, create_company, set_company)
+from trytond.pool import Pool
+from trytond.tests.test_tryton import ModuleTestCase, with_transaction
+from trytond.transaction import Transaction, TransactionError
+
+
+def create_agronomics(surface=2, max_production=10000):
+    "Create a plantation with a parcel of the current crop and its contract"
+    pool = Pool()
+    ModelData = pool.get('ir.model.data')
+    Party = pool.get('party.party')
+    Template = pool.get('product.template')
+    Product = pool.get('product.product')
+    Taxon = pool.get('product.taxon')
+    DO = pool.get('agronomics.denomination_of_origin')
+    Ecological = pool.get('agronomics.ecological')
+    Crop = pool.get('agronomics.crop')
+    MaxProduction = pool.get('agronomics.max.production.allowed')
+    WeighingCenter = pool.get('agronomics.weighing.center')
+    Contract = pool.get('agronomics.contract')
+
+    today = datetime.date.today()
+    party, = Party.create([{'name': "Producer"}])
+    template, = Template.create([{
+                'name': "Grape",
+                'type': 'goods',
+                'default_uom': ModelData.get_id('product', 'uom_kilogram'),
+                }])
+    product, = Product.create([{'template': template.id}])
+    species, = Taxon.create([{'name': "Vitis", 'rank': 'species'}])
+    variety, = Taxon.create([{'name': "Macabeu", 'rank': 'variety'}])
+    do, = DO.create([{'name': "Catalunya"}])
+    ecological, = Ecological.create([{'name': "Ecological"}])
+    crop, = Crop.create([{
+                'code': str(today.year),
+                'name': str(today.year),
+                'start_date': datetime.date(today.year, 1, 1),
+                'end_date': datetime.date(today.year, 12, 31),
+                }])
+    MaxProduction.create([{
+                'crop': crop.id,
+                'product': product.id,
+                'denomination_origin': do.id,
+                'variety': variety.id,
+                'max_production': Decimal(max_production),
+                }])
+    center, = WeighingCenter.create([{'name': "Center"}])
+    data = SimpleNamespace(
+        party=party, template=template, product=product, species=species,
+        variety=variety, do=do, ecological=ecological, crop=crop,
+        center=center, date=today)
+    data.parcel = create_parcel(data, 'P1', surface=surface)
+    data.plantation = data.parcel.plantation
+    data.contract, = Contract.search([])
+    return data
+
+
+def create_parcel(data, code, surface=2, variety=None, dos=None):
+    "Create a plantation with a parcel of the crop under an active contract"
+    pool = Pool()
+    Plantation = pool.get('agronomics.plantation')
+    Parcel = pool.get('agronomics.parcel')
+    Contract = pool.get('agronomics.contract')
+
+    plantation, = Plantation.create([{
+                'code': code,
+                'party': data.party.id,
+                }])
+    parcel, = Parcel.create([{
+                'plantation': plantation.id,
+                'crop': data.crop.id,
+                'product': data.template.id,
+                'species': data.species.id,
+                'variety': (variety or data.variety).id,
+                'ecological': data.ecological.id,
+                'surface': surface,
+                'denomination_origin': [('add', [d.id
+                            for d in (dos if dos is not None else [data.do])
+                            ])],
+                }])
+    contract, = Contract.create([{
+                'crop': data.crop.id,
+                'party': data.party.id,
+                'lines': [('create', [{'parcel': parcel.id}])],
+                }])
+    Contract.active([contract])
+    return parcel
+
+
+def create_weighings(data, netweights, plantations=('P1',)):
+    "Create draft weighings of the net weights on the plantations"
+    Weighing = Pool().get('agronomics.weighing')
+    results = Weighing.import_tickets([{
+                'weighing_center': data.center.id,
+                'weighing_date': data.date,
+                'plantations': list(plantations),
+                'weight': netweight,
+                'netweight': netweight,
+                'grade': 12,
+                } for netweight in netweights])
+    return Weighing.browse([r['id'] for r in results])
 
-from trytond.modules.company.tests import CompanyTestMixin
-from trytond.tests.test_tryton import ModuleTestCase
+
+def set_analysis(data, company):
+    "Set the accounts and the location to analyse and do the weighings"
+    pool = Pool()
+    ModelData = pool.get('ir.model.data')
+    Account = pool.get('account.account')
+    Category = pool.get('product.category')
+    Template = pool.get('product.template')
+    WeighingCenter = pool.get('agronomics.weighing.center')
+
+    create_chart(company)
+    expense, = Account.search([
+            ('type.expense', '=', True),
+            ('closed', '=', False),
+            ], limit=1)
+    revenue, = Account.search([
+            ('type.revenue', '=', True),
+            ('closed', '=', False),
+            ], limit=1)
+    category, = Category.create([{
+                'name': "Account",
+                'accounting': True,
+                'account_expense': expense.id,
+                'account_revenue': revenue.id,
+                }])
+    Template.write([data.template], {'account_category': category.id})
+    WeighingCenter.write([data.center], {
+            'to_location': ModelData.get_id('stock', 'location_stock'),
+            })
+
+
+def analyse_weighings(weighings):
+    "Process and distribute the weighings to put them in analysis"
+    Weighing = Pool().get('agronomics.weighing')
+    Weighing.process(weighings)
+    Weighing.distribute(weighings)
+    weighings = Weighing.browse(weighings)
+    assert all(w.state == 'in_analysis' for w in weighings)
+    return weighings
 
 
 class AgronomicsTestCase(CompanyTestMixin, ModuleTestCase):
     'Test Agronomics module'
     module = 'agronomics'
 
+    @with_transaction()
+    def test_parcel_quantities(self):
+        "Test parcel quantities match the per record computation"
+        pool = Pool()
+        DO = pool.get('agronomics.denomination_of_origin')
+        MaxProduction = pool.get('agronomics.max.production.allowed')
+        Parcel = pool.get('agronomics.parcel')
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+
+        def quantities(parcel):
+            max_productions = MaxProduction.search([
+                    ('crop', '=', parcel.crop.id),
+                    ('variety', '=', parcel.variety.id),
+                    ('denomination_origin', 'in',
+                        [d.id for d in parcel.denomination_origin]),
+                    ])
+            max_production = None
+            if max_productions:
+                max_production = round(float(min(
+                            m.max_production for m in max_productions))
+                    * parcel.surface, 2)
+            purchased_quantity = sum(
+                w.netweight or 0 for w in parcel.weighings if not w.table)
+            return (max_production, purchased_quantity,
+                (max_production or 0) - purchased_quantity)
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            penedes, = DO.create([{'name': "Penedès"}])
+            MaxProduction.create([{
+                        'crop': data.crop.id,
+                        'product': data.product.id,
+                        'denomination_origin': penedes.id,
+                        'variety': data.variety.id,
+                        'max_production': Decimal(8000),
+                        }])
+            parcels = [
+                data.parcel,
+                create_parcel(data, 'P2', surface=1.5,
+                    dos=[data.do, penedes]),
+                create_parcel(data, 'P3', dos=[]),
+                ]
+            WeighingParcel.create([
+                    {'parcel': parcels[0].id, 'netweight': 5000},
+                    {'parcel': parcels[0].id, 'netweight': 700,
+                        'table': True},
+                    {'parcel': parcels[1].id, 'netweight': 25000},
+                    {'parcel': parcels[2].id, 'netweight': 100},
+                    ])
+
+            for parcel in Parcel.browse([p.id for p in parcels]):
+                self.assertEqual(
+                    (parcel.max_production, parcel.purchased_quantity,
+                        parcel.remaining_quantity),
+                    quantities(parcel))
+
+            # Without the ledger the quantities are computed
+            HarvestLedger.delete(HarvestLedger.search([]))
+            for parcel in Parcel.browse([p.id for p in parcels]):
+                self.assertEqual(
+                    (parcel.max_production, parcel.purchased_quantity,
+                        parcel.remaining_quantity),
+                    quantities(parcel))
+
+    @with_transaction()
+    def test_plantation_values(self):
+        "Test plantation values match the per record computation"
+        pool = Pool()
+        DO = pool.get('agronomics.denomination_of_origin')
+        Taxon = pool.get('product.taxon')
+        Crop = pool.get('agronomics.crop')
+        Plantation = pool.get('agronomics.plantation')
+        Parcel = pool.get('agronomics.parcel')
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+
+        def values(plantation):
+            parcels = sorted(plantation.parcels, key=lambda p: p.id)
+            first = parcels[0] if parcels else None
+            return {
+                'do': {d.name for p in parcels
+                    for d in p.denomination_origin},
+                'varieties': {p.variety.name for p in parcels},
+                'purchased_quantity': sum(
+                    p.purchased_quantity or 0 for p in parcels),
+                'remaining_quantity': sum(
+                    p.remaining_quantity or 0 for p in parcels),
+                'product': first.product if first else None,
+                'variety': first.variety if first else None,
+                'ecological': first.ecological if first else None,
+                }
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            penedes, = DO.create([{'name': "Penedès"}])
+            parellada, = Taxon.create([{
+                        'name': "Parellada", 'rank': 'variety'}])
+            next_crop, = Crop.create([{
+                        'code': 'next',
+                        'name': "Next",
+                        'start_date': data.date.replace(
+                            year=data.date.year + 1, month=1, day=1),
+                        'end_date': data.date.replace(
+                            year=data.date.year + 1, month=12, day=31),
+                        }])
+            parcel, = Parcel.copy([data.parcel], default={
+                    'crop': next_crop.id,
+                    'variety': parellada.id,
+                    'denomination_origin': [('add', [penedes.id])],
+                    })
+            other = create_parcel(data, 'P2', dos=[])
+            empty, = Plantation.create([{
+                        'code': 'P3', 'party': data.party.id}])
+            WeighingParcel.create([
+                    {'parcel': data.parcel.id, 'netweight': 5000},
+                    {'parcel': parcel.id, 'netweight': 3000},
+                    {'parcel': other.id, 'netweight': 100},
+                    ])
+
+            for plantation in Plantation.browse(
+                    [data.plantation.id, other.plantation.id, empty.id]):
+                self.assertEqual({
+                        'do': set(filter(None, plantation.do.split(','))),
+                        'varieties': set(filter(None,
+                                (plantation.varieties or '').split(', '))),
+                        'purchased_quantity': plantation.purchased_quantity,
+                        'remaining_quantity': plantation.remaining_quantity,
+                        'product': plantation.product,
+                        'variety': plantation.variety,
+                        'ecological': plantation.ecological,
+                        }, values(plantation))
+
+    @with_transaction()
+    def test_plantation_search(self):
+        "Test search plantations by DO and ecological"
+        pool = Pool()
+        DO = pool.get('agronomics.denomination_of_origin')
+        Ecological = pool.get('agronomics.ecological')
+        Crop = pool.get('agronomics.crop')
+        Plantation = pool.get('agronomics.plantation')
+        Parcel = pool.get('agronomics.parcel')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            penedes, = DO.create([{'name': "Penedès"}])
+            other, = Ecological.create([{'name': "Other"}])
+            next_crop, = Crop.create([{
+                        'code': 'next',
+                        'name': "Next",
+                        'start_date': datetime.date(data.date.year + 1, 1, 1),
+                        'end_date': datetime.date(data.date.year + 1, 12, 31),
+                        }])
+            Parcel.copy([data.parcel], default={
+                    'crop': next_crop.id,
+                    'denomination_origin': [
+                        ('add', [data.do.id, penedes.id])],
+                    })
+            plantation1 = data.plantation
+            plantation2 = create_parcel(data, 'P2', dos=[penedes]).plantation
+            Parcel.write(list(plantation2.parcels), {'ecological': other.id})
+            plantation3 = create_parcel(data, 'P3', dos=[]).plantation
+
+            for domain, expected in [
+                    (('do', '=', "Catalunya"), [plantation1]),
+                    (('do', '=', "Penedès"), [plantation1, plantation2]),
+                    (('do', 'ilike', "%"), [plantation1, plantation2]),
+                    (('do', '!=', "Catalunya"), [plantation1, plantation2]),
+                    (('ecological', '=', data.ecological.id),
+                        [plantation1, plantation3]),
+                    (('ecological', '=', other.id), [plantation2]),
+                    ]:
+                self.assertEqual(
+                    Plantation.search([domain], order=[('id', 'ASC')]),
+                    expected, msg=domain)
+                self.assertEqual(
+                    Plantation.search([domain], count=True),
+                    len(expected), msg=domain)
+
+    @with_transaction()
+    def test_parcel_find_by_plantation_crop(self):
+        "Test find parcel by plantation and crop after their change"
+        pool = Pool()
+        Parcel = pool.get('agronomics.parcel')
+        Plantation = pool.get('agronomics.plantation')
+        Crop = pool.get('agronomics.crop')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            plantation2, = Plantation.create([{
+                        'code': 'P2',
+                        'party': data.party.id,
+                        }])
+            year = data.date.year + 1
+            crop2, = Crop.create([{
+                        'code': str(year),
+                        'name': str(year),
+                        'start_date': datetime.date(year, 1, 1),
+                        'end_date': datetime.date(year, 12, 31),
+                        }])
+            key1 = (data.plantation.id, data.crop.id)
+            key2 = (plantation2.id, data.crop.id)
+            key3 = (plantation2.id, crop2.id)
+
+            self.assertEqual(
+                Parcel.find_by_plantation_crop([key1, key2, key3]),
+                {key1: data.parcel, key2: None, key3: None})
+
+            Parcel.write([data.parcel], {'plantation': plantation2.id})
+            self.assertEqual(
+                Parcel.find_by_plantation_crop([key1, key2, key3]),
+                {key1: None, key2: data.parcel, key3: None})
+
+            Parcel.write([data.parcel], {'crop': crop2.id})
+            self.assertEqual(
+                Parcel.find_by_plantation_crop([key1, key2, key3]),
+                {key1: None, key2: None, key3: data.parcel})
+
+    @with_transaction()
+    def test_crop_find_by_date(self):
+        "Test find crop by date and the crop dates constraints"
+        pool = Pool()
+        Crop = pool.get('agronomics.crop')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            crop = data.crop
+            year = data.date.year
+            next_crop, = Crop.create([{
+                        'code': 'next',
+                        'name': "Next",
+                        'start_date': datetime.date(year + 1, 1, 2),
+                        'end_date': datetime.date(year + 1, 12, 31),
+                        }])
+
+            for date, expected in [
+                    (datetime.date(year, 1, 1), crop),
+                    (datetime.date(year, 6, 15), crop),
+                    (datetime.date(year, 12, 31), crop),
+                    (datetime.date(year - 1, 12, 31), None),
+                    (datetime.date(year + 1, 1, 1), None),
+                    (datetime.date(year + 1, 1, 2), next_crop),
+                    (datetime.date(year + 2, 1, 1), None),
+                    (None, None),
+                    ]:
+                self.assertEqual(Crop.find_by_date(date), expected, msg=date)
+
+            # The cache is cleared when the crops change
+            Crop.write([crop], {'end_date': datetime.date(year, 6, 30)})
+            self.assertEqual(
+                Crop.find_by_date(datetime.date(year, 6, 30)), crop)
+            self.assertEqual(
+                Crop.find_by_date(datetime.date(year, 12, 31)), None)
+            late, = Crop.create([{
+                        'code': 'late',
+                        'name': "Late",
+                        'start_date': datetime.date(year, 7, 1),
+                        'end_date': datetime.date(year, 12, 31),
+                        }])
+            self.assertEqual(
+                Crop.find_by_date(datetime.date(year, 12, 31)), late)
+            Crop.delete([late])
+            self.assertEqual(
+                Crop.find_by_date(datetime.date(year, 12, 31)), None)
+
+            # The dates cannot overlap
+            with self.assertRaises(SQLConstraintError):
+                Crop.create([{
+                            'code': 'overlap',
+                            'name': "Overlap",
+                            'start_date': datetime.date(year, 6, 30),
+                            'end_date': datetime.date(year, 7, 15),
+                            }])
+
+    @with_transaction()
+    def test_crop_dates(self):
+        "Test crop start date must be before end date"
+        pool = Pool()
+        Crop = pool.get('agronomics.crop')
+
+        with self.assertRaises(SQLConstraintError):
+            Crop.create([{
+                        'code': 'reversed',
+                        'name': "Reversed",
+                        'start_date': datetime.date(2020, 9, 1),
+                        'end_date': datetime.date(2020, 8, 1),
+                        }])
+
+    @with_transaction()
+    def test_parcel_rec_name(self):
+        "Test parcel record name and search"
+        pool = Pool()
+        Crop = pool.get('agronomics.crop')
+        Parcel = pool.get('agronomics.parcel')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            next_crop, = Crop.create([{
+                        'code': 'next',
+                        'name': "Next",
+                        'start_date': datetime.date(data.date.year + 1, 1, 1),
+                        'end_date': datetime.date(data.date.year + 1, 12, 31),
+                        }])
+            parcel1 = data.parcel
+            parcel2 = create_parcel(data, 'P10')
+            parcel3, = Parcel.copy([parcel1], default={'crop': next_crop.id})
+
+            parcels = Parcel.browse([parcel1.id, parcel2.id, parcel3.id])
+            self.assertEqual(
+                [p.rec_name for p in parcels],
+                ['P1 - %s' % data.crop.name, 'P10 - %s' % data.crop.name,
+                    'P1 - Next'])
+
+            for domain, expected in [
+                    (('rec_name', '=', 'P1'), [parcel1, parcel3]),
+                    (('rec_name', 'ilike', 'p1%'),
+                        [parcel1, parcel2, parcel3]),
+                    (('rec_name', '=', 'Next'), [parcel3]),
+                    (('rec_name', 'ilike', '%ex%'), [parcel3]),
+                    (('rec_name', '=', data.crop.name), [parcel1, parcel2]),
+                    (('rec_name', '=', 'P9'), []),
+                    ]:
+                self.assertEqual(
+                    Parcel.search([domain], order=[('id', 'ASC')]),
+                    expected, msg=domain)
+
+    @with_transaction()
+    def test_import_tickets(self):
+        "Test import tickets with valid and invalid tickets"
+        pool = Pool()
+        Taxon = pool.get('product.taxon')
+        Crop = pool.get('agronomics.crop')
+        Weighing = pool.get('agronomics.weighing')
+        Parcel = pool.get('agronomics.parcel')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            ticket = {
+                'weighing_center': data.center.id,
+                'weighing_date': data.date,
+                'plantations': ['P1'],
+                'weight': 1000,
+                'netweight': 800,
+                'grade': 12.5,
+                }
+
+            results = Weighing.import_tickets([
+                    ticket,
+                    dict(ticket, weighing_center=None),
+                    dict(ticket, grade=None),
+                    dict(ticket, netweight=1200),
+                    dict(ticket, weight=-10),
+                    dict(ticket, plantations=['UNKNOWN']),
+                    dict(ticket, plantations=[]),
+                    dict(ticket, weight=500, netweight=0),
+                    ])
+
+            self.assertIn('id', results[0])
+            self.assertIn('id', results[7])
+            for result in results[1:7]:
+                self.assertEqual(list(result), ['error'])
+            weighing = Weighing(results[0]['id'])
+            self.assertEqual(weighing.purchase_contract, data.contract)
+            self.assertEqual(weighing.product, data.template)
+            self.assertEqual(weighing.netweight, 800)
+            self.assertEqual(Weighing.search([], count=True), 2)
+
+            # The tickets breaking the domains do not fail the batch
+            Crop.create([{
+                        'code': 'next',
+                        'name': "Next",
+                        'start_date': datetime.date(data.date.year + 1, 1, 1),
+                        'end_date': datetime.date(data.date.year + 1, 12, 31),
+                        }])
+            parellada, = Taxon.create([{
+                        'name': "Parellada", 'rank': 'variety'}])
+            for code in ['P2', 'P3', 'P4', 'P5']:
+                create_parcel(data, code)
+            create_parcel(data, 'P6', variety=parellada)
+            results = Weighing.import_tickets([
+                    dict(ticket, plantations=['P1', 'P2']),
+                    dict(ticket, crop='next'),
+                    dict(ticket, plantations=['P1', 'P2', 'P3', 'P4', 'P5']),
+                    dict(ticket, plantations=['P1', 'P6']),
+                    dict(ticket, plantations=['P6']),
+                    ])
+            self.assertEqual(
+                [list(r) for r in results],
+                [['id'], ['error'], ['error'], ['error'], ['id']])
+            self.assertEqual(Weighing.search([], count=True), 4)
+
+            Parcel.write([data.parcel], {'product': None})
+            result, = Weighing.import_tickets([ticket])
+            self.assertEqual(list(result), ['error'])
+            self.assertEqual(Weighing.search([], count=True), 4)
+
+    @with_transaction()
+    def test_distribute(self):
+        "Test distribute weighings sharing the remaining quantity"
+        pool = Pool()
+        Weighing = pool.get('agronomics.weighing')
+        Parcel = pool.get('agronomics.parcel')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics(surface=2, max_production=10000)
+            weighing1, weighing2, table = create_weighings(
+                data, [15000, 10000, 3000])
+            Weighing.write([table], {
+                    'table': True,
+                    'denomination_origin': [('remove', [data.do.id])],
+                    })
+            Weighing.process([weighing1, weighing2, table])
+
+            with patch.object(Weighing, 'analysis') as analysis:
+                Weighing.distribute([weighing1, weighing2, table])
+            analysis.assert_called_once_with([weighing1, table])
+
+            weighing1, weighing2, table = Weighing.browse(
+                [weighing1.id, weighing2.id, table.id])
+            self.assertEqual(
+                [(p.parcel, p.netweight, bool(p.table))
+                    for p in weighing1.parcels],
+                [(data.parcel, 15000, False)])
+            self.assertEqual(
+                [(p.parcel, p.netweight, bool(p.table))
+                    for p in weighing2.parcels],
+                [(data.parcel, 5000, False)])
+            self.assertEqual(weighing2.not_assigned_weight, 5000)
+            self.assertEqual(
+                [(p.parcel, p.netweight, bool(p.table))
+                    for p in table.parcels],
+                [(data.parcel, 3000, True)])
+            parcel = Parcel(data.parcel.id)
+            self.assertEqual(parcel.purchased_quantity, 20000)
+            self.assertEqual(parcel.remaining_quantity, 0)
+
+            # The parcel is over its max production
+            Parcel.write([parcel], {'surface': 1})
+            weighing3, = create_weighings(data, [1000])
+            Weighing.process([weighing3])
+            with patch.object(Weighing, 'analysis') as analysis:
+                Weighing.distribute([weighing3])
+            analysis.assert_called_once_with([])
+
+            weighing3 = Weighing(weighing3.id)
+            self.assertEqual(weighing3.parcels, ())
+            self.assertEqual(weighing3.not_assigned_weight, 1000)
+            self.assertEqual(weighing3.state, 'distributed')
+            parcel = Parcel(data.parcel.id)
+            self.assertEqual(parcel.remaining_quantity, -10000)
+
+    @with_transaction()
+    def test_force_analysis(self):
+        "Test force analysis splits the not assigned weight"
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        Template = pool.get('product.template')
+        QualityTemplate = pool.get('quality.template')
+        Parcel = pool.get('agronomics.parcel')
+        Weighing = pool.get('agronomics.weighing')
+        WeighingCenter = pool.get('agronomics.weighing.center')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics(surface=2, max_production=10000)
+            WeighingCenter.write([data.center], {
+                    'to_location': ModelData.get_id('stock', 'location_stock'),
+                    })
+            quality_template, = QualityTemplate.create([{'name': "Grape"}])
+            Template.write([data.template], {
+                    'quality_weighing': quality_template.id,
+                    })
+            template2, = Template.create([{
+                        'name': "White Grape",
+                        'type': 'goods',
+                        'default_uom': data.template.default_uom.id,
+                        }])
+            parcel2 = create_parcel(data, 'P2')
+            Parcel.write([parcel2], {'product': template2.id})
+
+            weighing1, weighing2 = create_weighings(data, [30000, 1000])
+            weighing3, = create_weighings(data, [25000], plantations=['P2'])
+            weighings = [weighing1, weighing2, weighing3]
+            Weighing.process(weighings)
+            for weighing in weighings:
+                Weighing.distribute([weighing])
+            self.assertEqual(
+                [w.state for w in Weighing.browse(weighings)],
+                ['distributed'] * 3)
+
+            Weighing.force_analysis(Weighing.browse(weighings))
+
+            weighings = Weighing.browse(weighings)
+            self.assertEqual(
+                [(w.state, w.forced_analysis, w.weight, w.netweight)
+                    for w in weighings],
+                [('in_analysis', True, 30000, 20000),
+                    ('in_analysis', True, 1000, 0),
+                    ('in_analysis', True, 25000, 20000)])
+            self.assertEqual(
+                [sum(p.netweight for p in w.parcels) for w in weighings],
+                [20000, 0, 20000])
+            for weighing in weighings:
+                self.assertTrue(weighing.product_created)
+                self.assertEqual(
+                    weighing.inventory_move.quantity, weighing.netweight)
+                self.assertEqual(weighing.inventory_move.state, 'done')
+            self.assertEqual(
+                [bool(w.quality_test) for w in weighings],
+                [True, True, False])
+
+            copies = Weighing.search([
+                    ('id', 'not in', [w.id for w in weighings]),
+                    ], order=[('id', 'ASC')])
+            self.assertEqual(
+                [(w.forced_analysis, w.weight, w.netweight, w.product,
+                        w.parcels, w.product_created) for w in copies],
+                [(False, 10000, 10000, data.template, (), None),
+                    (False, 1000, 1000, data.template, (), None),
+                    (False, 5000, 5000, template2, (), None)])
+
+    @with_transaction()
+    def test_weighing_all_do_quality_test(self):
+        "Test all DO and quality test of weighings are their own"
+        pool = Pool()
+        DO = pool.get('agronomics.denomination_of_origin')
+        Product = pool.get('product.product')
+        QualityTemplate = pool.get('quality.template')
+        QualityTest = pool.get('quality.test')
+        Weighing = pool.get('agronomics.weighing')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            penedes, = DO.create([{'name': "Penedès"}])
+            quality_template, = QualityTemplate.create([{'name': "Grape"}])
+            weighing1, weighing2, weighing3, weighing4 = create_weighings(
+                data, [1000, 2000, 3000, 4000])
+            product1, product2, product3 = Product.create(
+                [{'template': data.template.id}] * 3)
+            Weighing.write([weighing1], {
+                    'denomination_origin': [('add', [penedes.id])],
+                    'product_created': product1.id,
+                    }, [weighing2], {
+                    'denomination_origin': [
+                        ('remove', [data.do.id]), ('add', [penedes.id])],
+                    'product_created': product2.id,
+                    }, [weighing3], {
+                    'denomination_origin': [('remove', [data.do.id])],
+                    'product_created': product3.id,
+                    })
+            test1, test2, _, _ = QualityTest.create([{
+                        'test_date': datetime.datetime.now(),
+                        'templates': [('add', [quality_template.id])],
+                        'document': str(product),
+                        } for product in [product1, product2, product1,
+                        product2]])
+
+            weighings = Weighing.browse(
+                [weighing1.id, weighing2.id, weighing3.id, weighing4.id])
+            self.assertEqual(
+                [w.all_do for w in weighings],
+                ["Catalunya,Penedès", "Penedès", "", "Catalunya"])
+            self.assertEqual(
+                [w.quality_test for w in weighings],
+                [test1, test2, None, None])
+
+    @with_transaction()
+    def test_do_price_lists(self):
+        "Test do prices each weighing with the price lists of its contract"
+        pool = Pool()
+        Party = pool.get('party.party')
+        PriceListType = pool.get('product.price_list.type')
+        PriceList = pool.get('product.price_list')
+        ContractPriceList = pool.get(
+            'agronomics.contract-product.price_list.type-product.price_list')
+        Contract = pool.get('agronomics.contract')
+        Beneficiary = pool.get('agronomics.beneficiary')
+        Weighing = pool.get('agronomics.weighing')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            set_analysis(data, company)
+            parcel2 = create_parcel(data, 'P2')
+            contract2, = Contract.search([('id', '!=', data.contract.id)])
+            premium, = PriceListType.create([{'name': "Premium"}])
+            price_list1, price_list2, price_list3 = PriceList.create([{
+                        'name': name,
+                        'lines': [('create', [{'formula': formula}])],
+                        } for name, formula in [
+                        ("Contract 1", '0.5'),
+                        ("Contract 2", '0.7'),
+                        ("Premium", '0.9'),
+                        ]])
+            ContractPriceList.create([{
+                        'contract': data.contract.id,
+                        'price_list': price_list1.id,
+                        }, {
+                        'contract': contract2.id,
+                        'price_list': price_list2.id,
+                        }, {
+                        'contract': data.contract.id,
+                        'price_list_type': premium.id,
+                        'price_list': price_list3.id,
+                        }])
+            party1, party2 = Party.create([
+                    {'name': "Beneficiary 1"},
+                    {'name': "Beneficiary 2"},
+                    ])
+            Beneficiary.create([{
+                        'parcel': data.parcel.id,
+                        'party': party1.id,
+                        }, {
+                        'parcel': data.parcel.id,
+                        'party': party2.id,
+                        'product_price_list_type': premium.id,
+                        }, {
+                        'parcel': parcel2.id,
+                        'party': party1.id,
+                        }])
+            weighing1, = create_weighings(data, [1000])
+            weighing2, = create_weighings(data, [1000], plantations=['P2'])
+            weighing1, weighing2 = analyse_weighings([weighing1, weighing2])
+
+            Weighing.do([weighing1, weighing2])
+
+            weighing1, weighing2 = Weighing.browse([weighing1, weighing2])
+            self.assertEqual(
+                weighing1.product_created.template,
+                weighing2.product_created.template)
+            for weighing, prices in [
+                    (weighing1, [(party1.id, Decimal('0.5')),
+                            (party2.id, Decimal('0.9'))]),
+                    (weighing2, [(party1.id, Decimal('0.7'))]),
+                    ]:
+                self.assertEqual(weighing.state, 'done')
+                self.assertEqual(
+                    sorted((line.party.id, line.unit_price)
+                        for line in weighing.beneficiaries_invoices_line),
+                    prices)
+                self.assertEqual(
+                    weighing.inventory_move.unit_price,
+                    sum(p for _, p in prices))
+
+    @with_transaction()
+    def test_do_cost_price(self):
+        "Test do sets the cost prices like a recompute per weighing"
+        pool = Pool()
+        Party = pool.get('party.party')
+        Template = pool.get('product.template')
+        Product = pool.get('product.product')
+        PriceList = pool.get('product.price_list')
+        ContractPriceList = pool.get(
+            'agronomics.contract-product.price_list.type-product.price_list')
+        Contract = pool.get('agronomics.contract')
+        Beneficiary = pool.get('agronomics.beneficiary')
+        Weighing = pool.get('agronomics.weighing')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            set_analysis(data, company)
+            Template.write([data.template], {'cost_price_method': 'average'})
+            parcel2 = create_parcel(data, 'P2')
+            price_list, = PriceList.create([{
+                        'name': "Price List",
+                        'lines': [('create', [{'formula': '0.5'}])],
+                        }])
+            ContractPriceList.create([{
+                        'contract': c.id,
+                        'price_list': price_list.id,
+                        } for c in Contract.search([])])
+            party1, party2 = Party.create([
+                    {'name': "Beneficiary 1"},
+                    {'name': "Beneficiary 2"},
+                    ])
+            Beneficiary.create([
+                    {'parcel': data.parcel.id, 'party': party1.id},
+                    {'parcel': parcel2.id, 'party': party1.id},
+                    {'parcel': parcel2.id, 'party': party2.id},
+                    ])
+            weighings = analyse_weighings(
+                create_weighings(data, [1000, 2000])
+                + create_weighings(data, [500], plantations=['P2']))
+
+            Weighing.do(weighings)
+
+            weighings = Weighing.browse(weighings)
+            for weighing in weighings:
+                lines = weighing.beneficiaries_invoices_line
+                cost_price = sum(line.unit_price for line in lines)
+                self.assertEqual(weighing.state, 'done')
+                self.assertEqual(
+                    [line.quantity for line in lines],
+                    [weighing.netweight] * len(lines))
+                self.assertEqual(
+                    weighing.inventory_move.unit_price, cost_price)
+                self.assertEqual(
+                    weighing.product_created.cost_price, cost_price)
+            self.assertEqual(
+                [w.product_created.cost_price for w in weighings],
+                [Decimal('0.5'), Decimal('0.5'), Decimal('1')])
+
+            # A recompute per weighing gives the same cost prices
+            products = [w.product_created for w in weighings]
+            cost_prices = [p.cost_price for p in products]
+            for product in products:
+                Product.recompute_cost_price([product], start=data.date)
+            self.assertEqual(
+                [p.cost_price for p in Product.browse(products)], cost_prices)
+
+    @with_transaction()
+    def test_queued_transition(self):
+        "Test queued and synchronous transitions of weighings"
+        pool = Pool()
+        Weighing = pool.get('agronomics.weighing')
+        WeighingCenter = pool.get('agronomics.weighing.center')
+        Beneficiary = pool.get('agronomics.beneficiary')
+        Queue = pool.get('ir.queue')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            queued, synchronous = create_weighings(data, [1000, 2000])
+            center, = WeighingCenter.create([{'name': "Synchronous"}])
+            Weighing.write([synchronous], {'weighing_center': center.id})
+            WeighingCenter.write([data.center], {'queue_transitions': True})
+
+            Weighing.process([queued, synchronous])
+            queued, synchronous = Weighing.browse([queued.id, synchronous.id])
+            self.assertEqual(
+                (synchronous.state, synchronous.queue_state),
+                ('processing', None))
+            self.assertEqual(
+                (queued.state, queued.queue_state), ('draft', 'queued'))
+            task, = Queue.search([])
+            self.assertEqual(task.data['method'], 'process')
+            self.assertEqual(task.data['instances'], [queued.id])
+
+            # The weighings already queued are not queued again
+            Weighing.process([queued])
+            self.assertEqual(Queue.search([], count=True), 1)
+
+            task.run()
+            queued = Weighing(queued.id)
+            self.assertEqual(
+                (queued.state, queued.queue_state), ('processing', None))
+
+            # The synchronous transitions clear the previous queue errors
+            Weighing.draft([synchronous])
+            Weighing.write([synchronous], {
+                    'queue_state': 'failed',
+                    'queue_error': "Error",
+                    })
+            Weighing.process([synchronous])
+            synchronous = Weighing(synchronous.id)
+            self.assertEqual(
+                (synchronous.state, synchronous.queue_state,
+                    synchronous.queue_error),
+                ('processing', None, None))
+
+            # The worker retries the transaction errors
+            Weighing.draft([queued])
+            Weighing.process([queued])
+            task, = Queue.search([('finished_at', '=', None)])
+            with patch.object(Beneficiary, 'create',
+                    side_effect=TransactionError()), \
+                    self.assertRaises(TransactionError):
+                task.run()
+
+    @with_transaction()
+    def test_harvest_ledger(self):
+        "Test the harvest ledger follows the changes of the quantities"
+        pool = Pool()
+        Taxon = pool.get('product.taxon')
+        MaxProduction = pool.get('agronomics.max.production.allowed')
+        Plantation = pool.get('agronomics.plantation')
+        Parcel = pool.get('agronomics.parcel')
+        ParcelDo = pool.get('agronomics.parcel-agronomics.do')
+        Weighing = pool.get('agronomics.weighing')
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        cursor = Transaction().connection.cursor()
+
+        def check():
+            parcel_ids = [p.id for p in Parcel.search([])]
+            lines = HarvestLedger.search([])
+            self.assertEqual({
+                    line.parcel.id: (line.crop.id,
+                        line.max_production, line.purchased_quantity)
+                    for line in lines},
+                Parcel.compute_quantities(parcel_ids))
+            for line in lines:
+                self.assertEqual(line.remaining_quantity,
+                    (line.max_production or 0) - line.purchased_quantity)
+            for plantation in Plantation.search([]):
+                self.assertEqual(
+                    Plantation.search([
+                            ('remaining_quantity', '=',
+                                plantation.remaining_quantity),
+                            ('id', '=', plantation.id),
+                            ]),
+                    [plantation])
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            parcel1 = data.parcel
+            parcel2 = create_parcel(data, 'P2', dos=[])
+            parellada, = Taxon.create([{
+                        'name': "Parellada", 'rank': 'variety'}])
+            check()
+
+            # Weighing parcel lines
+            lines = WeighingParcel.create([
+                    {'parcel': parcel1.id, 'netweight': 5000},
+                    {'parcel': parcel1.id, 'netweight': 3000},
+                    {'parcel': parcel2.id, 'netweight': 700},
+                    ])
+            check()
+            WeighingParcel.write([lines[0]], {'netweight': 4000})
+            check()
+            WeighingParcel.write([lines[1]], {'parcel': parcel2.id})
+            check()
+            WeighingParcel.write([lines[2]], {'table': True})
+            check()
+            WeighingParcel.delete([lines[0]])
+            check()
+
+            # Parcel denominations of origin
+            Parcel.write([parcel2], {
+                    'denomination_origin': [('add', [data.do.id])],
+                    })
+            check()
+            ParcelDo.write(
+                ParcelDo.search([('parcel', '=', parcel2.id)]),
+                {'parcel': parcel1.id})
+            check()
+            Parcel.write([parcel1], {
+                    'denomination_origin': [('remove', [data.do.id])],
+                    })
+            check()
+            Parcel.write([parcel1, parcel2], {
+                    'denomination_origin': [('add', [data.do.id])],
+                    })
+            check()
+
+            # Parcel surface and variety
+            Parcel.write([parcel1], {'surface': 3.5})
+            check()
+            Parcel.write([parcel2], {'variety': parellada.id})
+            check()
+
+            # Max productions
+            max_production, = MaxProduction.search([])
+            MaxProduction.write([max_production], {
+                    'max_production': Decimal(7000),
+                    })
+            check()
+            other, = MaxProduction.copy([max_production], default={
+                    'variety': parellada.id,
+                    'max_production': Decimal(9000),
+                    })
+            check()
+            MaxProduction.write([max_production], {
+                    'variety': parellada.id,
+                    })
+            check()
+            MaxProduction.delete([other])
+            check()
+
+            # Weighings
+            weighing, = create_weighings(data, [1000])
+            WeighingParcel.create([{
+                        'weighing': weighing.id,
+                        'parcel': parcel1.id,
+                        'netweight': 1000,
+                        }])
+            check()
+            Weighing.delete([weighing])
+            check()
+
+            # Rebuild
+            ledger = HarvestLedger.__table__()
+            cursor.execute(*ledger.update(
+                    [ledger.purchased_quantity], [0]))
+            cursor.execute(*ledger.delete(
+                    where=ledger.parcel == parcel2.id))
+            HarvestLedger.rebuild()
+            check()
+
+    @with_transaction()
+    def test_process_beneficiaries(self):
+        "Test process copies the beneficiaries of the parcels"
+        pool = Pool()
+        Party = pool.get('party.party')
+        Weighing = pool.get('agronomics.weighing')
+        WeighingPlantation = pool.get(
+            'agronomics.weighing-agronomics.plantation')
+        Beneficiary = pool.get('agronomics.beneficiary')
+        Plantation = pool.get('agronomics.plantation')
+
+        def beneficiaries(records):
+            return sorted(
+                (b.party.id, b.product_price_list_type) for b in records)
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            parcel2 = create_parcel(data, 'P2')
+            party1, party2, party3 = Party.create([
+                    {'name': "Beneficiary 1"},
+                    {'name': "Beneficiary 2"},
+                    {'name': "Beneficiary 3"},
+                    ])
+            Beneficiary.create([
+                    {'parcel': data.parcel.id, 'party': party1.id},
+                    {'parcel': data.parcel.id, 'party': party2.id},
+                    {'parcel': parcel2.id, 'party': party3.id},
+                    ])
+            weighing1, weighing2 = create_weighings(data, [1000, 2000])
+            weighing3, = create_weighings(data, [500], plantations=['P2'])
+
+            Weighing.process([weighing1, weighing2, weighing3])
+            for weighing, parcel in [
+                    (weighing1, data.parcel),
+                    (weighing2, data.parcel),
+                    (weighing3, parcel2),
+                    ]:
+                weighing = Weighing(weighing.id)
+                self.assertEqual(
+                    beneficiaries(weighing.beneficiaries),
+                    beneficiaries(parcel.beneficiaries))
+
+            # Processing again replaces the beneficiaries
+            Weighing.draft([weighing1])
+            Weighing.process([weighing1])
+            weighing1 = Weighing(weighing1.id)
+            self.assertEqual(
+                beneficiaries(weighing1.beneficiaries),
+                beneficiaries(data.parcel.beneficiaries))
+            self.assertEqual(Beneficiary.search([
+                        ('weighing', '!=', None),
+                        ], count=True), 5)
+
+            # A plantation without parcel in the crop
+            plantation, = Plantation.create([{
+                        'code': 'P3', 'party': data.party.id}])
+            WeighingPlantation.create([{
+                        'weighing': weighing2.id,
+                        'plantation': plantation.id,
+                        }])
+            Weighing.draft([weighing2])
+            with self.assertRaises(UserError):
+                Weighing.process([weighing2])
+
+    @with_transaction()
+    def test_not_assigned_weight(self):
+        "Test not assigned weight getter and searcher"
+        pool = Pool()
+        Weighing = pool.get('agronomics.weighing')
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            weighings = create_weighings(data, [1000, 2000, 3000, 500])
+            WeighingParcel.create([
+                    {'weighing': weighings[0].id, 'parcel': data.parcel.id,
+                        'netweight': 1000},
+                    {'weighing': weighings[1].id, 'parcel': data.parcel.id,
+                        'netweight': 1200},
+                    {'weighing': weighings[1].id, 'parcel': data.parcel.id,
+                        'netweight': 300},
+                    {'weighing': weighings[2].id, 'parcel': data.parcel.id,
+                        'netweight': None},
+                    ])
+
+            weighings = Weighing.browse([w.id for w in weighings])
+            not_assigned_weights = {
+                w: w.netweight - sum(p.netweight or 0 for p in w.parcels)
+                for w in weighings}
+            self.assertEqual(
+                {w: w.not_assigned_weight for w in weighings},
+                not_assigned_weights)
+            self.assertEqual(
+                list(not_assigned_weights.values()), [0, 500, 3000, 500])
+
+            for operator, value, expected in [
+                    ('=', 0, [0]),
+                    ('!=', 0, [1, 2, 3]),
+                    ('=', 500, [1, 3]),
+                    ('>', 400, [1, 2, 3]),
+                    ('<=', 500, [0, 1, 3]),
+                    ('in', [0, 3000], [0, 2]),
+                    ]:
+                self.assertEqual(
+                    Weighing.search([
+                            ('not_assigned_weight', operator, value),
+                            ], order=[('id', 'ASC')]),
+                    [weighings[i] for i in expected],
+                    msg=(operator, value))
+
+    @with_transaction()
+    def test_weighing_daily_summary(self):
+        "Test weighing daily summary totals per day and center"
+        pool = Pool()
+        Weighing = pool.get('agronomics.weighing')
+        WeighingCenter = pool.get('agronomics.weighing.center')
+        Summary = pool.get('agronomics.weighing.daily_summary')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            center2, = WeighingCenter.create([{'name': "Center 2"}])
+            day1 = datetime.date(data.date.year, 6, 1)
+            day2 = datetime.date(data.date.year, 6, 2)
+            weighing1, weighing2, weighing3, weighing4 = create_weighings(
+                data, [1000, 3000, 2000, 500])
+            for weighing, center, date, weight, grade in [
+                    (weighing1, data.center, day1, 1100, 12),
+                    (weighing2, data.center, day1, 3200, 14),
+                    (weighing3, data.center, day2, 2000, 10),
+                    (weighing4, center2, day1, 600, 11),
+                    ]:
+                Weighing.write([weighing], {
+                        'weighing_center': center.id,
+                        'weighing_date': date,
+                        'weight': weight,
+                        'grade': grade,
+                        })
+
+            summaries = Summary.search([])
+            self.assertEqual(
+                sorted((s.weighing_date, s.weighing_center.name, s.weighings,
+                        s.weight, s.netweight, round(s.grade, 2))
+                    for s in summaries),
+                [(day1, "Center", 2, 4300, 4000, 13.5),
+                    (day1, "Center 2", 1, 600, 500, 11),
+                    (day2, "Center", 1, 2000, 2000, 10)])
+
+    @with_transaction()
+    def test_export_weighings(self):
+        "Test export weighings as CSV and JSON lines"
+        pool = Pool()
+        Party = pool.get('party.party')
+        Weighing = pool.get('agronomics.weighing')
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        Beneficiary = pool.get('agronomics.beneficiary')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            create_parcel(data, 'P2')
+            weighing1, weighing2 = create_weighings(
+                data, [1000, 2000], plantations=['P1', 'P2'])
+            weighing3, = create_weighings(data, [500])
+            Weighing.write([weighing3], {'state': 'cancelled'})
+            WeighingParcel.create([
+                    {'weighing': weighing1.id, 'parcel': data.parcel.id,
+                        'netweight': 1000},
+                    {'weighing': weighing2.id, 'parcel': data.parcel.id,
+                        'netweight': 1500},
+                    ])
+            party, = Party.create([{'name': "Beneficiary"}])
+            Beneficiary.create([
+                    {'weighing': weighing2.id, 'party': party.id},
+                    ])
+            domain = [('state', '!=', 'cancelled')]
+
+            file = io.StringIO()
+            Weighing.export_weighings(file, domain=domain, chunk_size=1)
+            file.seek(0)
+            rows = list(csv.DictReader(file))
+            self.assertEqual(
+                [(r['id'], r['weighing_center'], r['crop'], r['product'],
+                        r['netweight'], r['plantations'],
+                        r['denomination_origin'])
+                    for r in rows],
+                [(str(w.id), "Center", data.crop.code, "Grape",
+                        str(w.netweight), "P1,P2", "Catalunya")
+                    for w in [weighing1, weighing2]])
+
+            file = io.StringIO()
+            Weighing.export_weighings(
+                file, domain=domain, rows='parcel', format='jsonl',
+                chunk_size=1)
+            rows = list(map(json.loads, file.getvalue().splitlines()))
+            self.assertEqual(
+                [(r['weighing'], r['parcel'], r['plantation'],
+                        r['netweight']) for r in rows],
+                [(weighing1.id, data.parcel.id, 'P1', 1000),
+                    (weighing2.id, data.parcel.id, 'P1', 1500)])
+
+            file = io.StringIO()
+            Weighing.export_weighings(
+                file, domain=domain, rows='beneficiary', format='jsonl')
+            rows = list(map(json.loads, file.getvalue().splitlines()))
+            self.assertEqual(
+                [(r['weighing'], r['party'], r['party_name']) for r in rows],
+                [(weighing2.id, party.id, "Beneficiary")])
+
+            # The id of the chunks does not join an OR domain
+            file = io.StringIO()
+            Weighing.export_weighings(file, domain=[
+                    'OR',
+                    ('id', '=', weighing1.id),
+                    ('state', '=', 'cancelled'),
+                    ], format='jsonl', chunk_size=1)
+            rows = list(map(json.loads, file.getvalue().splitlines()))
+            self.assertEqual(
+                [r['id'] for r in rows], [weighing1.id, weighing3.id])
+
+    def test_parse_frame(self):
+        "Test parse frame of scale"
+        for frame, weight in [
+                (b'ST,GS,+0012340kg\r\n', 12340),
+                (b'ST,NT, +0000020.5kg', 20.5),
+                (b'ST,GS,-0000040kg', -40),
+                (b'US,GS,+0012340kg\r\n', None),
+                (b'ST,GS,+0012340lb', None),
+                (b'ST,+0012340kg', None),
+                (b'', None),
+                ]:
+            self.assertEqual(scale.parse_frame(frame), weight, msg=frame)
+
+    def test_read_scale(self):
+        "Test read scale puts the stable weights of the simulator"
+        frames = [
+            ('ST', 0), ('US', 5000), ('ST', 10), ('ST', 12000),
+            ('ST', 12000), ('US', 11000), ('ST', 0), ('ST', 12000),
+            ('ST', 4000),
+            ]
+
+        async def read():
+            queue = asyncio.Queue()
+            server = await asyncio.start_server(
+                lambda r, w: scale.simulate_scale(r, w, rate=1000),
+                '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            task = asyncio.create_task(
+                scale.read_scale(1, '127.0.0.1', port, queue))
+            try:
+                return [await asyncio.wait_for(queue.get(), 5)
+                    for _ in range(3)]
+            finally:
+                task.cancel()
+                await asyncio.wait([task])
+                # The simulator stops on the closed connection
+                await asyncio.sleep(0.1)
+                server.close()
+
+        with patch.object(scale, 'truck_frames',
+                side_effect=lambda rate: iter(frames)):
+            weights = asyncio.run(read())
+        self.assertEqual(weights, [(1, 12000), (1, 12000), (1, 4000)])
+
+    def test_read_scale_overlong_frame(self):
+        "Test read scale reconnects after a frame longer than the limit"
+        connections = []
+
+        async def send(reader, writer):
+            connections.append(writer)
+            if len(connections) == 1:
+                writer.write(b'ST,GS,+' + b'0' * 2 ** 17)
+            else:
+                writer.write(b'ST,GS,+0012000kg\r\n')
+            await writer.drain()
+
+        async def read():
+            queue = asyncio.Queue()
+            server = await asyncio.start_server(send, '127.0.0.1', 0)
+            port = server.sockets[0].getsockname()[1]
+            task = asyncio.create_task(
+                scale.read_scale(1, '127.0.0.1', port, queue, retry=0.01))
+            try:
+                return await asyncio.wait_for(queue.get(), 5)
+            finally:
+                task.cancel()
+                server.close()
+
+        with self.assertLogs(scale.logger, 'WARNING'):
+            weight = asyncio.run(read())
+        self.assertEqual(weight, (1, 12000))
+        self.assertEqual(len(connections), 2)
+
+    def test_write_weights(self):
+        "Test write weights sets the weights of the queue by batches"
+        async def write():
+            queue = asyncio.Queue()
+            for weight in [(1, 100), (2, 200), (1, 300)]:
+                queue.put_nowait(weight)
+            task = asyncio.create_task(
+                scale.write_weights('database', 0, queue))
+            try:
+                while set_weights.call_count < 2:
+                    await asyncio.sleep(0.01)
+            finally:
+                task.cancel()
+
+        with patch.object(scale, 'set_weights',
+                    side_effect=[ValueError("error"), [1]]) as set_weights, \
+                self.assertLogs(scale.logger, 'ERROR'):
+            asyncio.run(asyncio.wait_for(write(), 5))
+        self.assertEqual(
+            [c.args for c in set_weights.call_args_list],
+            [('database', 0, {1: 100, 2: 200}), ('database', 0, {1: 300})])
+
+    @with_transaction()
+    def test_set_scale_weights(self):
+        "Test set scale weights on the last draft weighing"
+        pool = Pool()
+        Weighing = pool.get('agronomics.weighing')
+        WeighingCenter = pool.get('agronomics.weighing.center')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            center, = WeighingCenter.create([{'name': "Other"}])
+            weighing1, weighing2 = create_weighings(data, [0, 0])
+
+            # The weight
+            self.assertEqual(
+                Weighing.set_scale_weights({str(data.center.id): 12000}),
+                [weighing2.id])
+            weighing1, weighing2 = Weighing.browse(
+                [weighing1.id, weighing2.id])
+            self.assertEqual(
+                (weighing2.weight, weighing2.netweight), (12000, 12000))
+            self.assertEqual(
+                (weighing1.weight, weighing1.netweight), (0, 0))
+
+            # Then the tara
+            self.assertEqual(
+                Weighing.set_scale_weights({data.center.id: 4000}),
+                [weighing2.id])
+            weighing2 = Weighing(weighing2.id)
+            self.assertEqual(
+                (weighing2.weight, weighing2.netweight, weighing2.tara),
+                (12000, 8000, 4000))
+
+            # The tara is set once
+            self.assertEqual(
+                Weighing.set_scale_weights({data.center.id: 3000}), [])
+            weighing2 = Weighing(weighing2.id)
+            self.assertEqual(weighing2.netweight, 8000)
+
+            # The weighing is no more the last draft weighing
+            Weighing.process([weighing2])
+            self.assertEqual(
+                Weighing.set_scale_weights({data.center.id: 0}), [])
+            self.assertEqual(
+                Weighing.set_scale_weights({
+                        data.center.id: 5000,
+                        center.id: 5000,
+                        }),
+                [weighing1.id])
+            weighing1 = Weighing(weighing1.id)
+            self.assertEqual(
+                (weighing1.weight, weighing1.netweight), (5000, 5000))
+
+    @with_transaction()
+    def test_close_numbers(self):
+        "Test close numbers renumbers only the weighings of reserved blocks"
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        SequenceStrict = pool.get('ir.sequence.strict')
+        Weighing = pool.get('agronomics.weighing')
+        WeighingCenter = pool.get('agronomics.weighing.center')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            WeighingCenter.write([data.center], {
+                    'weighing_sequence': ModelData.get_id(
+                        'agronomics', 'sequence_weighing'),
+                    })
+            sequenced, = create_weighings(data, [1000])
+            closing, = SequenceStrict.create([{
+                        'name': "Closing",
+                        'sequence_type': ModelData.get_id(
+                            'agronomics', 'sequence_type_weighing'),
+                        'prefix': 'C',
+                        }])
+            WeighingCenter.write([data.center], {
+                    'numbering': 'block',
+                    'closing_sequence': closing.id,
+                    })
+            with patch.object(WeighingCenter, 'reserve_numbers',
+                    side_effect=lambda count: [
+                        'B%s' % i for i in range(count)]):
+                block1, block2 = create_weighings(data, [1000, 2000])
+            sequence_number = sequenced.number
+
+            self.assertFalse(sequenced.block_number)
+            self.assertEqual(
+                [(w.number, w.block_number) for w in [block1, block2]],
+                [('B0', True), ('B1', True)])
+
+            # The weighings of the day are not closed
+            WeighingCenter.close_numbers(date=data.date)
+            self.assertEqual(
+                Weighing.search([('provisional_number', '!=', None)]), [])
+
+            tomorrow = data.date + datetime.timedelta(days=1)
+            WeighingCenter.close_numbers(date=tomorrow)
+            sequenced, block1, block2 = Weighing.browse(
+                [sequenced.id, block1.id, block2.id])
+            self.assertEqual(
+                (sequenced.number, sequenced.provisional_number),
+                (sequence_number, None))
+            self.assertEqual(
+                [(w.number, w.provisional_number) for w in [block1, block2]],
+                [('C1', 'B0'), ('C2', 'B1')])
+
+            # The weighings are closed once
+            WeighingCenter.close_numbers(date=tomorrow)
+            block1, block2 = Weighing.browse([block1.id, block2.id])
+            self.assertEqual(
+                [(w.number, w.provisional_number) for w in [block1, block2]],
+                [('C1', 'B0'), ('C2', 'B1')])
+
+    @with_transaction()
+    def test_reserve_numbers(self):
+        "Test reserve numbers refills the blocks from the sequence"
+        pool = Pool()
+        ModelData = pool.get('ir.model.data')
+        Sequence = pool.get('ir.sequence')
+        WeighingCenter = pool.get('agronomics.weighing.center')
+
+        WeighingCenter._number_blocks.clear()
+        self.addCleanup(WeighingCenter._number_blocks.clear)
+        # The blocks are reserved in a new transaction which would commit
+        # the records created by the test on an in-memory database
+        sequence = Sequence(
+            ModelData.get_id('agronomics', 'sequence_weighing'))
+        center = WeighingCenter(
+            numbering='block', number_block_size=3, weighing_sequence=sequence)
+
+        get_many = Sequence.get_many
+        with patch.object(Sequence, 'get_many', autospec=True,
+                side_effect=get_many) as reserve:
+            numbers = (center.reserve_numbers(2) + center.reserve_numbers(2)
+                + center.reserve_numbers(5))
+        self.assertEqual([c.args[1] for c in reserve.call_args_list], [3] * 3)
+        numbers = list(map(int, numbers))
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + 9)))
+        self.assertEqual(int(Sequence(sequence.id).get()), numbers[-1] + 1)
+
+    @with_transaction()
+    def test_distribute_lock(self):
+        "Test distribute locks the parcels to allocate"
+        pool = Pool()
+        Weighing = pool.get('agronomics.weighing')
+        Parcel = pool.get('agronomics.parcel')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics(surface=2, max_production=10000)
+            parcel1 = data.parcel
+            parcel2 = create_parcel(data, 'P2')
+            create_parcel(data, 'P3')
+            weighing1, = create_weighings(
+                data, [30000], plantations=['P1', 'P2'])
+            weighing2, = create_weighings(data, [15000], plantations=['P2'])
+            weighing3, = create_weighings(data, [1000], plantations=['P3'])
+            Weighing.process([weighing1, weighing2, weighing3])
+
+            with patch.object(Parcel, 'lock') as lock, \
+                    patch.object(Weighing, 'analysis'):
+                Weighing.distribute([weighing1])
+            lock.assert_called_once_with(sorted([parcel1.id, parcel2.id]))
+
+            with patch.object(Parcel, 'lock') as lock, \
+                    patch.object(Weighing, 'analysis'):
+                Weighing.distribute([weighing2])
+            lock.assert_called_once_with([parcel2.id])
+
+            weighing1, weighing2 = Weighing.browse(
+                [weighing1.id, weighing2.id])
+            self.assertEqual(
+                sorted((p.parcel.id, p.netweight) for p in weighing1.parcels),
+                sorted([(parcel1.id, 20000), (parcel2.id, 10000)]))
+            self.assertEqual(
+                [(p.parcel, p.netweight) for p in weighing2.parcels],
+                [(parcel2, 10000)])
+            self.assertEqual(weighing2.not_assigned_weight, 5000)
+            for parcel in Parcel.browse([parcel1.id, parcel2.id]):
+                self.assertEqual(parcel.purchased_quantity, 20000)
+                self.assertEqual(
+                    parcel.purchased_quantity, parcel.max_production)
+
+    @with_transaction()
+    def test_import_sigpac(self):
+        "Test import SIGPAC enclosures"
+        pool = Pool()
+        Enclosure = pool.get('agronomics.enclosure')
+
+        company = create_company()
+        with set_company(company):
+            data = create_agronomics()
+            plantation2 = create_parcel(data, 'P2').plantation
+
+            report = Enclosure.import_sigpac(io.StringIO(
+                    'province;municipality;aggregate;zone;polygon;parcel;'
+                    'enclosure;surface;plantation\n'
+                    '8;1;0;0;1;10;1;1,5;P1\n'
+                    '8;1;0;0;1;10;2;2;\n'
+                    '8;1;0;0;1;10;3;x;P1\n'
+                    '8;1;0;0;1;10;4;1;P9\n'
+                    '8;1;0;0;1;10;5;1;P1;extra\n'))
+            self.assertEqual(
+                report['created'], ['8-1-0-0-1-10-1', '8-1-0-0-1-10-2'])
+            self.assertEqual(report['updated'], [])
+            self.assertEqual(sorted(n for n, _ in report['errors']), [4, 5, 6])
+            enclosure1, = Enclosure.search(
+                [('sigpac_code', '=', '8-1-0-0-1-10-1')])
+            self.assertEqual(enclosure1.surface_sigpac, Decimal('1.5'))
+            self.assertEqual(enclosure1.plantation, data.plantation)
+            enclosure2, = Enclosure.search(
+                [('sigpac_code', '=', '8-1-0-0-1-10-2')])
+            self.assertEqual(enclosure2.plantation, None)
+
+            report = Enclosure.import_sigpac(io.StringIO(
+                    '080010000000010001000001          P2\n'
+                    '080010000000010001000002       2.5\n'
+                    '080010000000010001000006       3.0P1\n'),
+                format='fixed')
+            self.assertEqual(report['created'], ['8-1-0-0-1-10-6'])
+            self.assertEqual(
+                report['updated'], ['8-1-0-0-1-10-1', '8-1-0-0-1-10-2'])
+            self.assertEqual(report['errors'], [])
+            enclosure1, enclosure2 = Enclosure.browse(
+                [enclosure1.id, enclosure2.id])
+            self.assertEqual(enclosure1.surface_sigpac, Decimal('1.5'))
+            self.assertEqual(enclosure1.plantation, plantation2)
+            self.assertEqual(enclosure2.surface_sigpac, Decimal('2.5'))
+            self.assertEqual(enclosure2.plantation, None)
+
+            report = Enclosure.import_sigpac(io.StringIO(
+                    'province;municipality;aggregate;zone;polygon;parcel;'
+                    'enclosure\n'
+                    '8;1;0;0;1;10;1\n'))
+            self.assertEqual(report['unchanged'], 1)
+            enclosure1, = Enclosure.browse([enclosure1.id])
+            self.assertEqual(enclosure1.surface_sigpac, Decimal('1.5'))
+            self.assertEqual(enclosure1.plantation, plantation2)
+
+            # Duplicate codes and keys which are not integers
+            report = Enclosure.import_sigpac(io.StringIO(
+                    'province;municipality;aggregate;zone;polygon;parcel;'
+                    'enclosure;surface\n'
+                    '8;1;0;0;1;10;7;1\n'
+                    '8;1;0;0;1;10;7.0;2\n'
+                    '8;1;0;0;1;10;8.5;1\n'
+                    '8;1;0;0;1;10;NaN;1\n'
+                    '8;1;0;0;1;10;inf;1\n'
+                    '8;1;0;0;1;10;1e2;1\n'))
+            self.assertEqual(
+                report['created'], ['8-1-0-0-1-10-7', '8-1-0-0-1-10-100'])
+            self.assertEqual(
+                sorted(n for n, _ in report['errors']), [3, 4, 5, 6])
+            enclosure7, = Enclosure.search(
+                [('sigpac_code', '=', '8-1-0-0-1-10-7')])
+            self.assertEqual(enclosure7.surface_sigpac, Decimal(1))
+            self.assertFalse(Enclosure.search(
+                    [('enclosure_sigpac', '=', Decimal('8.5'))]))
+
+    @with_transaction()
+    def test_enclosure_sigpac_keys(self):
+        "Test the SIGPAC keys of the enclosures must be integers"
+        pool = Pool()
+        Enclosure = pool.get('agronomics.enclosure')
+
+        enclosure, = Enclosure.create([{
+                    k + '_sigpac': 1 for k in plot.SIGPAC_KEYS}])
+        self.assertEqual(enclosure.sigpac_code, '1-1-1-1-1-1-1')
+
+        with self.assertRaises(UserError):
+            Enclosure.write([enclosure], {'parcel_sigpac': Decimal('1.5')})
+
 
 del ModuleTestCase
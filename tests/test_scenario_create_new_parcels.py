@@ -1,5 +1,6 @@
 import datetime
 import unittest
+from decimal import Decimal
 
 from proteus import Model, Wizard
 from trytond.modules.company.tests.tools import create_company
@@ -32,7 +33,20 @@ class Test(unittest.TestCase):
         party = Party(name='Party')
         party.save()
 
+        # Create beneficiary
+        beneficiary = Party(name='Beneficiary')
+        beneficiary.save()
+
         # Create product
+        ProductUom = Model.get('product.uom')
+        kg, = ProductUom.find([('name', '=', 'Kilogram')])
+        ProductTemplate = Model.get('product.template')
+        template = ProductTemplate()
+        template.name = 'Grape'
+        template.default_uom = kg
+        template.type = 'goods'
+        template.list_price = Decimal(0)
+        template.save()
         Taxon = Model.get('product.taxon')
         DO = Model.get('agronomics.denomination_of_origin')
         Ecological = Model.get('agronomics.ecological')
@@ -91,17 +105,63 @@ class Test(unittest.TestCase):
         plantation.plantation_year = today.year
         parcel = plantation.parcels.new()
         parcel.crop = crop
+        parcel.product = template
         parcel.species = species
         parcel.variety = macabeu
         parcel.ecological = ecological
         parcel.surface = 100
+        parcel.denomination_origin.append(DO(catalunya.id))
+        parcel_beneficiary = parcel.beneficiaries.new()
+        parcel_beneficiary.party = beneficiary
         parcel2 = plantation.parcels.new()
         parcel2.crop = crop
+        parcel2.product = template
         parcel2.species = species
         parcel2.variety = macabeu
         parcel2.ecological = ecological
         parcel2.surface = 200
+        parcel2.denomination_origin.append(DO(catalunya.id))
+        parcel2.denomination_origin.append(DO(barcelona.id))
         plantation.save()
+        parcel, parcel2 = sorted(plantation.parcels, key=lambda p: p.surface)
+
+        # Create contract
+        Contract = Model.get('agronomics.contract')
+        contract = Contract()
+        contract.crop = crop
+        contract.party = party
+        contract_line = contract.lines.new()
+        contract_line.parcel = parcel
+        contract.save()
+        contract.click('active')
+
+        # Create weighing of the parcel with a beneficiary
+        WeighingCenter = Model.get('agronomics.weighing.center')
+        center = WeighingCenter(name='Center')
+        center.save()
+        Weighing = Model.get('agronomics.weighing')
+        weighing = Weighing()
+        weighing.weighing_date = today
+        weighing.weighing_center = center
+        weighing.crop = crop
+        weighing_plantation = weighing.plantations.new()
+        weighing_plantation.plantation = plantation
+        weighing.product = template
+        weighing.variety = macabeu
+        weighing.ecological = ecological
+        weighing.purchase_contract = contract
+        weighing.weight = 1000
+        weighing.netweight = 1000
+        weighing.grade = 12
+        weighing.save()
+        WeighingParcel = Model.get('agronomics.weighing-agronomics.parcel')
+        weighing_parcel = WeighingParcel(
+            weighing=weighing, parcel=parcel, netweight=1000)
+        weighing_parcel.save()
+        Beneficiary = Model.get('agronomics.beneficiary')
+        weighing_beneficiary = Beneficiary(
+            party=beneficiary, parcel=parcel, weighing=weighing)
+        weighing_beneficiary.save()
 
         # Search for parcels
         Parcel = Model.get('agronomics.parcel')
@@ -123,3 +183,46 @@ class Test(unittest.TestCase):
         Parcel = Model.get('agronomics.parcel')
         parcels = Parcel.find([('crop', '=', next_crop.id)])
         self.assertEqual(len(parcels), 2)
+
+        # The denominations of origin and parcel beneficiaries are copied
+        # but not the weighings and their beneficiaries
+        new_parcels = {p.previous_parcel.id: p for p in parcels}
+        new_parcel = new_parcels[parcel.id]
+        new_parcel2 = new_parcels[parcel2.id]
+        self.assertEqual(
+            sorted(d.name for d in new_parcel.denomination_origin),
+            ['Catalunya'])
+        self.assertEqual(
+            sorted(d.name for d in new_parcel2.denomination_origin),
+            ['Barcelona', 'Catalunya'])
+        self.assertEqual(
+            [(b.party, b.weighing) for b in new_parcel.beneficiaries],
+            [(beneficiary, None)])
+        self.assertEqual(len(new_parcel2.beneficiaries), 0)
+        self.assertEqual(len(new_parcel.weighings), 0)
+        self.assertEqual(len(Beneficiary.find([])), 3)
+
+        # The progress is shown on the crop
+        crop.reload()
+        self.assertEqual(crop.next_crop, next_crop)
+        self.assertEqual(crop.parcel_count, 2)
+        self.assertEqual(crop.copied_parcel_count, 2)
+
+        # Run again the interrupted copy
+        new_parcel2.delete()
+        crop.reload()
+        self.assertEqual(crop.copied_parcel_count, 1)
+        for _ in range(2):
+            wizard = Wizard('agronomics.create_new_parcels')
+            wizard.form.previous_crop = crop
+            wizard.form.next_crop = next_crop
+            wizard.execute('copy_parcels')
+        parcels = Parcel.find([('crop', '=', next_crop.id)])
+        self.assertEqual(
+            sorted(p.previous_parcel.id for p in parcels),
+            sorted([parcel.id, parcel2.id]))
+        new_parcel2, = [p for p in parcels if p.previous_parcel == parcel2]
+        self.assertEqual(len(new_parcel2.denomination_origin), 2)
+        self.assertEqual(len(Beneficiary.find([])), 3)
+        crop.reload()
+        self.assertEqual(crop.copied_parcel_count, 2)
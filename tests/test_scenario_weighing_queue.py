@@ -0,0 +1,150 @@
+import datetime
+import unittest
+
+from proteus import Model
+from trytond.modules.company.tests.tools import create_company
+from trytond.tests.test_tryton import drop_db
+from trytond.tests.tools import activate_modules
+
+
+class Test(unittest.TestCase):
+
+    def setUp(self):
+        drop_db()
+        super().setUp()
+
+    def tearDown(self):
+        drop_db()
+        super().tearDown()
+
+    def test(self):
+
+        today = datetime.date.today()
+
+        # Activate modules
+        activate_modules('agronomics')
+
+        # Create company
+        _ = create_company()
+
+        # Create parties
+        Party = Model.get('party.party')
+        party = Party(name='Party')
+        party.save()
+        beneficiary = Party(name='Beneficiary')
+        beneficiary.save()
+
+        # Create product
+        ProductUom = Model.get('product.uom')
+        kg, = ProductUom.find([('name', '=', 'Kilogram')])
+        ProductTemplate = Model.get('product.template')
+        template = ProductTemplate()
+        template.name = 'Grape'
+        template.default_uom = kg
+        template.type = 'goods'
+        template.save()
+
+        # Create species, variety and ecological
+        Taxon = Model.get('product.taxon')
+        species = Taxon(rank='species', name='Species')
+        species.save()
+        macabeu = Taxon(rank='variety', name='Macabeu')
+        macabeu.save()
+        Ecological = Model.get('agronomics.ecological')
+        ecological = Ecological(name='Ecological')
+        ecological.save()
+
+        # Create Crop
+        Crop = Model.get('agronomics.crop')
+        crop = Crop()
+        crop.name = str(today.year)
+        crop.code = str(today.year)
+        crop.start_date = datetime.date(today.year, 1, 1)
+        crop.end_date = datetime.date(today.year, 12, 31)
+        crop.save()
+
+        # Create Plantation with a beneficiary
+        Plantation = Model.get('agronomics.plantation')
+        plantation = Plantation()
+        plantation.party = party
+        plantation.code = 'P1'
+        parcel = plantation.parcels.new()
+        parcel.crop = crop
+        parcel.product = template
+        parcel.species = species
+        parcel.variety = macabeu
+        parcel.ecological = ecological
+        parcel.surface = 100
+        parcel_beneficiary = parcel.beneficiaries.new()
+        parcel_beneficiary.party = beneficiary
+        plantation.save()
+        parcel, = plantation.parcels
+
+        # Create contract
+        Contract = Model.get('agronomics.contract')
+        contract = Contract()
+        contract.crop = crop
+        contract.party = party
+        contract_line = contract.lines.new()
+        contract_line.parcel = parcel
+        contract.save()
+        contract.click('active')
+
+        # Create weighing
+        WeighingCenter = Model.get('agronomics.weighing.center')
+        center = WeighingCenter(name='Center')
+        center.save()
+        Weighing = Model.get('agronomics.weighing')
+        weighing = Weighing()
+        weighing.weighing_date = today
+        weighing.weighing_center = center
+        weighing.crop = crop
+        weighing_plantation = weighing.plantations.new()
+        weighing_plantation.plantation = plantation
+        weighing.product = template
+        weighing.variety = macabeu
+        weighing.ecological = ecological
+        weighing.purchase_contract = contract
+        weighing.weight = 1000
+        weighing.netweight = 1000
+        weighing.grade = 12
+        weighing.save()
+
+        # Process the weighing synchronously
+        weighing.click('process')
+        self.assertEqual(weighing.state, 'processing')
+        self.assertEqual(
+            [b.party for b in weighing.beneficiaries], [beneficiary])
+        weighing.click('draft')
+
+        # Add a plantation without parcel in the crop
+        other_plantation = Plantation(party=party, code='P2')
+        other_plantation.save()
+        WeighingPlantation = Model.get(
+            'agronomics.weighing-agronomics.plantation')
+        other_weighing_plantation = WeighingPlantation(
+            weighing=weighing, plantation=other_plantation)
+        other_weighing_plantation.save()
+
+        # Queue the failing transition
+        center.queue_transitions = True
+        center.save()
+        weighing.click('process')
+        weighing.reload()
+        self.assertEqual(weighing.state, 'draft')
+        self.assertEqual(weighing.queue_state, 'failed')
+        self.assertIn('P2', weighing.queue_error)
+
+        # The changes of the failed transition are rollbacked
+        self.assertEqual(
+            [b.party for b in weighing.beneficiaries], [beneficiary])
+
+        # The weighing processed synchronously is cleared of the error
+        other_weighing_plantation.delete()
+        center.queue_transitions = False
+        center.save()
+        weighing.reload()
+        weighing.click('process')
+        self.assertEqual(weighing.state, 'processing')
+        self.assertEqual(weighing.queue_state, None)
+        self.assertEqual(weighing.queue_error, None)
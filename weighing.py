@@ -1,13 +1,96 @@
 # This file is part of Tryton.  The COPYRIGHT file at the top level of
 # this repository contains the full copyright notices and license terms.
-from trytond.model import fields, ModelSQL, ModelView, Workflow, sequence_ordered
+from sql import Literal, Null
+from sql.aggregate import Count, Max, Min, Sum
+from sql.conditionals import Coalesce, NullIf
+from sql.functions import CurrentTimestamp
+
+from trytond import backend
+from trytond.model import (fields, Index, ModelSQL, ModelView, Workflow,
+    sequence_ordered)
 from trytond.pyson import Id, Eval, If, Bool
-from trytond.pool import Pool
+from trytond.pool import Pool, PoolMeta
+from trytond.rpc import RPC
 from trytond.i18n import gettext
 from trytond.exceptions import UserError
-from trytond.transaction import Transaction
+from trytond.tools import grouped_slice, reduce_ids
+from trytond.transaction import Transaction, TransactionError
+import csv
+import json
+import logging
+from collections import defaultdict, deque
 from datetime import datetime
 from decimal import Decimal
+from functools import wraps
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+
+def queued_transition(func):
+    """Run the transition of the weighings of the centers that queue them
+    from ir.queue, in chunks of the center's batch size.
+
+    The errors of a queued chunk are stored on its weighings instead of
+    being raised, except those retried by the worker. The weighings already
+    queued are not queued again and the weighings run synchronously are
+    cleared of their previous queue errors."""
+    @wraps(func)
+    def wrapper(cls, weighings, *args, **kwargs):
+        transaction = Transaction()
+        if transaction.context.get('queued_weighing_transition'):
+            try:
+                result = func(cls, weighings, *args, **kwargs)
+            except (TransactionError, backend.DatabaseOperationalError):
+                raise
+            except Exception as exception:
+                logger.warning("%s of weighings %s failed",
+                    func.__name__, [w.id for w in weighings], exc_info=True)
+                if isinstance(exception, UserError):
+                    error = exception.message
+                else:
+                    error = str(exception) or repr(exception)
+                transaction.rollback()
+                cls.write(weighings, {
+                        'queue_state': 'failed',
+                        'queue_error': error,
+                        })
+                return
+            cls.write(weighings, {
+                    'queue_state': None,
+                    'queue_error': None,
+                    })
+            return result
+
+        to_queue = defaultdict(list)
+        to_run, to_reset = [], []
+        for weighing in weighings:
+            if weighing.queue_state == 'queued':
+                continue
+            center = weighing.weighing_center
+            if center and center.queue_transitions:
+                to_queue[center.queue_batch or True].append(weighing)
+            else:
+                to_run.append(weighing)
+                if weighing.queue_state or weighing.queue_error:
+                    to_reset.append(weighing)
+        for queue_batch, records in to_queue.items():
+            cls.write(records, {
+                    'queue_state': 'queued',
+                    'queue_error': None,
+                    })
+            with transaction.set_context(queue_batch=queue_batch,
+                    queued_weighing_transition=True):
+                getattr(cls.__queue__, func.__name__)(
+                    records, *args, **kwargs)
+        result = func(cls, to_run, *args, **kwargs)
+        if to_reset:
+            cls.write(to_reset, {
+                    'queue_state': None,
+                    'queue_error': None,
+                    })
+        return result
+    return wrapper
 
 
 class WeighingCenter(ModelSQL, ModelView):
@@ -22,6 +105,124 @@ class WeighingCenter(ModelSQL, ModelView):
     warehouse = fields.Many2One('stock.location', "Warehouse",
         domain=[('type', '=', 'warehouse')])
     to_location = fields.Many2One('stock.location', "To Location")
+    queue_transitions = fields.Boolean("Queue Transitions",
+        help="Run the process, distribute, force analysis and done "
+        "transitions of the weighings in tasks of the queue.\n"
+        "Without a queue worker, the tasks run after the commit of the "
+        "request that queued them.")
+    queue_batch = fields.Integer("Queue Batch Size",
+        domain=[
+            If(Bool(Eval('queue_batch')), ('queue_batch', '>', 0), ()),
+            ],
+        states={
+            'invisible': ~Eval('queue_transitions'),
+            },
+        help="The number of weighings run by each task.\n"
+        "Leave empty to use the default of the queue.\n"
+        "Without a queue worker, it is ignored and all the weighings run in "
+        "one task.")
+    numbering = fields.Selection([
+            ('sequence', "Sequence"),
+            ('block', "Reserved Blocks"),
+            ], "Numbering", required=True,
+        help="Sequence: take the numbers from the weighing sequence "
+        "when creating the weighings.\n"
+        "Reserved Blocks: take the numbers from blocks reserved by each "
+        "server process, the numbers are not consecutive.")
+    number_block_size = fields.Integer("Number Block Size",
+        domain=[
+            If(Bool(Eval('number_block_size')),
+                ('number_block_size', '>', 0), ()),
+            ],
+        states={
+            'invisible': Eval('numbering') != 'block',
+            'required': Eval('numbering') == 'block',
+            })
+    closing_sequence = fields.Many2One('ir.sequence.strict',
+        "Closing Sequence",
+        domain=[
+            ('sequence_type', '=', Id('agronomics', 'sequence_type_weighing')),
+            ],
+        states={
+            'invisible': Eval('numbering') != 'block',
+            },
+        help="Renumber without gaps the weighings of the previous days "
+        "when closing the day.")
+    scale_host = fields.Char("Scale Host",
+        help="The host of the scale indicator read by the scale listener.")
+    scale_port = fields.Integer("Scale Port",
+        states={
+            'required': Bool(Eval('scale_host')),
+            'invisible': ~Eval('scale_host'),
+            })
+
+    _number_blocks = defaultdict(deque)
+    _number_blocks_lock = Lock()
+
+    @classmethod
+    def default_numbering(cls):
+        return 'sequence'
+
+    @classmethod
+    def default_number_block_size(cls):
+        return 50
+
+    def reserve_numbers(self, count):
+        "Return count numbers from the blocks reserved by the process"
+        pool = Pool()
+        Sequence = pool.get('ir.sequence')
+        transaction = Transaction()
+        key = (
+            transaction.database.name, self.id, self.weighing_sequence.id)
+        with self._number_blocks_lock:
+            numbers = self._number_blocks[key]
+            if len(numbers) < count:
+                size = max(self.number_block_size or 1, count - len(numbers))
+                # Reserve in its own transaction to release the sequence
+                with transaction.new_transaction():
+                    sequence = Sequence(self.weighing_sequence.id)
+                    numbers.extend(sequence.get_many(size))
+            return [numbers.popleft() for _ in range(count)]
+
+    @classmethod
+    def close_numbers(cls, centers=None, date=None):
+        """Renumber from the closing sequence the weighings of the centers
+        before the date
+
+        Only the weighings numbered from reserved blocks are renumbered, once,
+        in date and creation order, and they keep their previous number as
+        provisional number."""
+        pool = Pool()
+        Date = pool.get('ir.date')
+        Weighing = pool.get('agronomics.weighing')
+        if centers is None:
+            centers = cls.search([
+                    ('numbering', '=', 'block'),
+                    ('closing_sequence', '!=', None),
+                    ])
+        if date is None:
+            date = Date.today()
+        to_write = []
+        for center in centers:
+            if not center.closing_sequence:
+                continue
+            weighings = Weighing.search([
+                    ('weighing_center', '=', center.id),
+                    ('weighing_date', '<', date),
+                    ('block_number', '=', True),
+                    ('provisional_number', '=', None),
+                    ('number', '!=', None),
+                    ], order=[('weighing_date', 'ASC'), ('id', 'ASC')])
+            if not weighings:
+                continue
+            numbers = center.closing_sequence.get_many(len(weighings))
+            for weighing, number in zip(weighings, numbers):
+                to_write.extend(([weighing], {
+                            'number': number,
+                            'provisional_number': weighing.number,
+                            }))
+        if to_write:
+            Weighing.write(*to_write)
 
 
 class Weighing(Workflow, ModelSQL, ModelView):
@@ -30,6 +231,14 @@ class Weighing(Workflow, ModelSQL, ModelView):
     _rec_name = 'number'
 
     number = fields.Char('Number', readonly=True)
+    provisional_number = fields.Char("Provisional Number", readonly=True,
+        states={
+            'invisible': ~Eval('provisional_number'),
+            },
+        help="The number of the weighing before closing the day.")
+    block_number = fields.Boolean("Block Number", readonly=True,
+        help="The number was taken from a reserved block and is renumbered "
+        "when closing the day.")
     weighing_date = fields.Date('Date', states={
             'readonly': Eval('state') != 'draft',
             }, required=True)
@@ -130,10 +339,20 @@ class Weighing(Workflow, ModelSQL, ModelView):
     parcels = fields.One2Many('agronomics.weighing-agronomics.parcel',
         'weighing', 'Parcels', readonly=True)
     not_assigned_weight = fields.Function(
-        fields.Float('Not Assigned Weight'), 'get_not_assigned_weight')
+        fields.Float('Not Assigned Weight'), 'get_not_assigned_weight',
+        searcher='search_not_assigned_weight')
     forced_analysis = fields.Boolean('Forced Analysis', readonly=True)
     inventory_move = fields.Many2One('stock.move', "Inventory Move",
         readonly=True)
+    queue_state = fields.Selection([
+            (None, ""),
+            ('queued', "Queued"),
+            ('failed', "Failed"),
+            ], "Queue State", readonly=True)
+    queue_error = fields.Text("Queue Error", readonly=True,
+        states={
+            'invisible': Eval('queue_state') != 'failed',
+            })
 
     @classmethod
     def __setup__(cls):
@@ -142,6 +361,19 @@ class Weighing(Workflow, ModelSQL, ModelView):
             ('weighing_date', 'DESC NULLS FIRST'),
             ('id', 'DESC'),
             ]
+        t = cls.__table__()
+        cls._sql_indexes.update({
+                Index(t,
+                    (t.weighing_date, Index.Range(order='DESC NULLS FIRST')),
+                    (t.id, Index.Range(order='DESC'))),
+                Index(t,
+                    (t.weighing_center, Index.Equality()),
+                    (t.crop, Index.Equality()),
+                    (t.weighing_date, Index.Range()),
+                    (t.variety, Index.Equality()),
+                    (t.ecological, Index.Equality()),
+                    (t.state, Index.Equality())),
+                })
         cls._transitions |= set((
                 ('draft', 'processing'),
                 ('processing', 'draft'),
@@ -187,6 +419,10 @@ class Weighing(Workflow, ModelSQL, ModelView):
                     'icon': 'tryton-forward',
                     },
                 })
+        cls.__rpc__.update({
+                'import_tickets': RPC(readonly=False),
+                'set_scale_weights': RPC(readonly=False),
+                })
 
     @staticmethod
     def default_weighing_date():
@@ -197,16 +433,44 @@ class Weighing(Workflow, ModelSQL, ModelView):
     def default_state():
         return 'draft'
 
-    def get_all_do(self, name):
-        return ",".join([x.name for x in self.denomination_origin])
+    @classmethod
+    def get_all_do(cls, weighings, name):
+        pool = Pool()
+        WeighingDo = pool.get('agronomics.weighing-agronomics.do')
+        DO = pool.get('agronomics.denomination_of_origin')
+        weighing_do = WeighingDo.__table__()
+        do = DO.__table__()
+        cursor = Transaction().connection.cursor()
+
+        names = defaultdict(list)
+        for sub_weighings in grouped_slice(weighings):
+            cursor.execute(*weighing_do.join(do,
+                    condition=weighing_do.do == do.id
+                    ).select(weighing_do.weighing, do.name,
+                    where=reduce_ids(weighing_do.weighing,
+                        [w.id for w in sub_weighings]),
+                    order_by=weighing_do.id))
+            for weighing_id, do_name in cursor:
+                names[weighing_id].append(do_name)
+        return {w.id: ",".join(names[w.id]) for w in weighings}
 
-    def get_quality_test(self, name):
-        if not self.product_created:
-            return
-        tests = self.product_created.quality_tests
-        if not tests:
-            return
-        return tests and tests[0] and tests[0].id
+    @classmethod
+    def get_quality_test(cls, weighings, name):
+        pool = Pool()
+        QualityTest = pool.get('quality.test')
+        test = QualityTest.__table__()
+        cursor = Transaction().connection.cursor()
+
+        documents = {str(w.product_created): w.id
+            for w in weighings if w.product_created}
+        tests = dict.fromkeys([w.id for w in weighings])
+        for sub_documents in grouped_slice(list(documents)):
+            cursor.execute(*test.select(test.document, Min(test.id),
+                    where=test.document.in_(list(sub_documents)),
+                    group_by=test.document))
+            for document, test_id in cursor:
+                tests[documents[document]] = test_id
+        return tests
 
     @classmethod
     def set_quality_test(cls, weighings, name, value):
@@ -216,26 +480,20 @@ class Weighing(Workflow, ModelSQL, ModelView):
     @fields.depends('weighing_date')
     def on_change_weighing_date(self):
         Crop = Pool().get('agronomics.crop')
-        crops = Crop.search([
-                ('start_date', '<=', self.weighing_date),
-                ('end_date', '>=', self.weighing_date),
-                ])
-        if len(crops) == 1:
-            self.crop = crops[0]
+        crop = Crop.find_by_date(self.weighing_date)
+        if crop:
+            self.crop = crop
 
     @fields.depends('plantations', 'crop')
     def get_parcel(self):
-        if not self.plantations:
+        Parcel = Pool().get('agronomics.parcel')
+        if not self.plantations or not self.crop:
             return
         plantation = self.plantations[0].plantation
         if not plantation:
             return
-        res = None
-        for parcel in plantation.parcels:
-            if parcel.crop == self.crop:
-                res = parcel
-                break
-        return res
+        key = (plantation.id, self.crop.id)
+        return Parcel.find_by_plantation_crop([key])[key]
 
     @fields.depends('plantations', 'ecological', 'denomination_origin',
         methods=['get_parcel'])
@@ -279,26 +537,21 @@ class Weighing(Workflow, ModelSQL, ModelView):
         pool = Pool()
         Product = pool.get('product.product')
         Quality = pool.get('quality.test')
-        Variety = pool.get('product.variety')
         Move = pool.get('stock.move')
         Location = pool.get('stock.location')
         Company = pool.get('company.company')
 
+        if not weighings:
+            return
+
         supplier_location = Location.search([('code', '=', 'SUP')], limit=1)
         if not supplier_location:
             #Supplier location not found
             raise UserError()
-
-        default_product_values = Product.default_get(Product._fields.keys(),
-            with_rec_name=False)
-        product = Product(**default_product_values)
-        default_move_values = Move.default_get(Move._fields.keys(),
-                with_rec_name=False)
-        move = Move(**default_move_values)
+        supplier_location, = supplier_location
 
         company = Company(Transaction().context.get('company'))
 
-        to_done = []
         for weighing in weighings:
             if weighing.not_assigned_weight and not weighing.forced_analysis:
                 raise UserError(gettext('agronomics.msg_not_assigned_weight',
@@ -308,119 +561,190 @@ class Weighing(Workflow, ModelSQL, ModelView):
                 raise UserError(gettext('agronomics.msg_weighing_with_table_do',
                     weighing=weighing.rec_name))
 
-            product.template = weighing.product
-            product.denominations_of_origin = weighing.denomination_origin
-            if weighing.ecological:
-                product.ecologicals = [weighing.ecological]
-            if weighing.variety:
-                new_variety = Variety()
-                new_variety.percent = 100
-                new_variety.variety = weighing.variety
-                product.varieties = [new_variety]
-            product.vintages = [weighing.crop.id]
-            weighing.product_created = product
-
             if not weighing.weighing_center:
                 raise UserError()
 
-            # Create Move
-            move.from_location = supplier_location[0]
             if not weighing.weighing_center.to_location:
                 raise UserError(
                     gettext('agronomics.msg_location_no_configured',
                     center=weighing.weighing_center.name))
-            move.to_location = weighing.weighing_center.to_location
-            move.product = weighing.product_created
-            move.currency = company.currency
-            move.unit = weighing.product_created.template.default_uom
-            # TODO: Price should be based on price list of the supplier
-            #move.unit_price = weighing.product_created.template.list_price
-            move.unit_price = Decimal(0)
-            move.quantity = weighing.netweight or 0
-
-            weighing.inventory_move = move
-            to_done.append(move)
-
-        cls.save(weighings)
-        with Transaction().set_context(_skip_warnings=True):
-            Move.do(to_done)
-        tests = []
+
+        default_product_values = Product.default_get(Product._fields.keys(),
+            with_rec_name=False)
+        product_vlist = []
         for weighing in weighings:
-            tests.append(weighing.create_quality_test())
-        Quality.save(tests)
+            values = default_product_values.copy()
+            values['template'] = weighing.product.id
+            values['denominations_of_origin'] = [('add',
+                    [d.id for d in weighing.denomination_origin])]
+            if weighing.ecological:
+                values['ecologicals'] = [('add', [weighing.ecological.id])]
+            if weighing.variety:
+                values['varieties'] = [('create', [{
+                                'percent': 100,
+                                'variety': weighing.variety.id,
+                                }])]
+            values['vintages'] = [('add', [weighing.crop.id])]
+            product_vlist.append(values)
+        products = Product.create(product_vlist)
+
+        default_move_values = Move.default_get(Move._fields.keys(),
+                with_rec_name=False)
+        move_vlist = []
+        for weighing, product in zip(weighings, products):
+            values = default_move_values.copy()
+            values.update({
+                    'from_location': supplier_location.id,
+                    'to_location': weighing.weighing_center.to_location.id,
+                    'product': product.id,
+                    'currency': company.currency.id,
+                    'unit': weighing.product.default_uom.id,
+                    # TODO: Price should be based on price list of the
+                    # supplier
+                    'unit_price': Decimal(0),
+                    'quantity': weighing.netweight or 0,
+                    })
+            move_vlist.append(values)
+        moves = Move.create(move_vlist)
+
+        to_write = []
+        for weighing, product, move in zip(weighings, products, moves):
+            to_write.extend(([weighing], {
+                        'product_created': product.id,
+                        'inventory_move': move.id,
+                        }))
+        cls.write(*to_write)
+        with Transaction().set_context(_skip_warnings=True):
+            Move.do(moves)
+        tests = [w.create_quality_test()
+            for w in cls.browse([w.id for w in weighings])]
+        Quality.save([t for t in tests if t])
 
     @classmethod
     @ModelView.button
+    @queued_transition
     @Workflow.transition('distributed')
     def distribute(cls, weighings):
         pool = Pool()
         WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        Parcel = pool.get('agronomics.parcel')
+
+        WeighingParcel.delete([p for w in weighings if not w.table
+                for p in w.parcels])
+
+        pairs = {(wp.plantation.id, w.crop.id) for w in weighings
+            for wp in w.plantations if wp.plantation}
+        parcels = Parcel.find_by_plantation_crop(pairs)
+        # Lock only the parcels to allocate so concurrent distributions can
+        # not exceed their remaining quantity while the other parcels are
+        # still distributed in parallel
+        Parcel.lock(sorted({p.id for p in parcels.values() if p}))
+        # Remaining capacity of the parcels updated by each allocation, so
+        # weighings of the same batch do not see stale quantities
+        remaining_quantities = Parcel.get_quantities(
+            [p for p in parcels.values() if p],
+            ['remaining_quantity'])['remaining_quantity']
+
         weighing_parcel_to_save = []
         to_analysis = []
         for weighing in weighings:
+            allowed_parcels = [
+                parcels.get((wp.plantation.id, weighing.crop.id))
+                for wp in weighing.plantations if wp.plantation]
             if not weighing.table:
-                if weighing.parcels:
-                    WeighingParcel.delete(weighing.parcels)
-                allowed_parcels = []
-                for wp in weighing.plantations:
-                    plantation = wp.plantation
-                    if plantation:
-                        for parcel in plantation.parcels:
-                            if parcel.crop == weighing.crop:
-                                allowed_parcels.append(parcel)
-                                break
                 remaining_weight = weighing.netweight
-                for parcel in allowed_parcels:
+                for parcel in filter(None, allowed_parcels):
                     if not remaining_weight:
                         break
-                    weighing_parcel = WeighingParcel()
-                    weighing_parcel.parcel = parcel
-                    weighing_parcel.weighing = weighing
-                    if parcel.remaining_quantity - remaining_weight >= 0:
-                        weighing_parcel.netweight = remaining_weight
-                        remaining_weight = 0
-                    else:
-                        remaining_weight -= parcel.remaining_quantity
-                        weighing_parcel.netweight = parcel.remaining_quantity
-                    if weighing_parcel.netweight:
-                        weighing_parcel_to_save.append(weighing_parcel)
+                    available = max(remaining_quantities[parcel.id], 0)
+                    netweight = min(available, remaining_weight)
+                    if not netweight:
+                        continue
+                    remaining_weight -= netweight
+                    remaining_quantities[parcel.id] -= netweight
+                    weighing_parcel_to_save.append(WeighingParcel(
+                            parcel=parcel,
+                            weighing=weighing,
+                            netweight=netweight))
                 if remaining_weight == 0:
                     to_analysis.append(weighing)
             else:
-                parcel = weighing.get_parcel()
-                weighing_parcel = WeighingParcel()
-                weighing_parcel.parcel = parcel
-                weighing_parcel.weighing = weighing
-                weighing_parcel.netweight = weighing.netweight
-                weighing_parcel.table = True
-                weighing_parcel_to_save.append(weighing_parcel)
+                parcel = allowed_parcels[0] if allowed_parcels else None
+                weighing_parcel_to_save.append(WeighingParcel(
+                        parcel=parcel,
+                        weighing=weighing,
+                        netweight=weighing.netweight,
+                        table=True))
                 to_analysis.append(weighing)
         WeighingParcel.save(weighing_parcel_to_save)
-        cls.save(weighings)
         cls.analysis(to_analysis)
 
-    def get_not_assigned_weight(self, name):
-        return (self.netweight or 0) - sum([(p.netweight or 0)
-            for p in self.parcels])
+    @classmethod
+    def get_not_assigned_weight(cls, weighings, name):
+        assigned_weights = cls.get_assigned_weights(weighings)
+        return {w.id: (w.netweight or 0) - assigned_weights[w.id]
+            for w in weighings}
+
+    @classmethod
+    def search_not_assigned_weight(cls, name, clause):
+        pool = Pool()
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        table = cls.__table__()
+        weighing_parcel = WeighingParcel.__table__()
+        _, operator, value = clause
+        Operator = fields.SQL_OPERATORS[operator]
+
+        assigned_weight = weighing_parcel.select(
+            Coalesce(Sum(Coalesce(weighing_parcel.netweight, 0)), 0),
+            where=weighing_parcel.weighing == table.id)
+        query = table.select(table.id,
+            where=Operator(
+                Coalesce(table.netweight, 0) - assigned_weight, value))
+        return [('id', 'in', query)]
+
+    @classmethod
+    def get_assigned_weights(cls, weighings):
+        "Return the net weight assigned to the parcels of each weighing"
+        pool = Pool()
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        weighing_parcel = WeighingParcel.__table__()
+        cursor = Transaction().connection.cursor()
+
+        weights = dict.fromkeys(map(int, weighings), 0)
+        for sub_ids in grouped_slice(list(weights)):
+            cursor.execute(*weighing_parcel.select(
+                    weighing_parcel.weighing,
+                    Sum(Coalesce(weighing_parcel.netweight, 0)),
+                    where=reduce_ids(weighing_parcel.weighing, sub_ids),
+                    group_by=weighing_parcel.weighing))
+            weights.update(cursor)
+        return weights
 
     @classmethod
     @ModelView.button
+    @queued_transition
     def force_analysis(cls, weighings):
-        to_copy_values = {}
-        for weighing in weighings:
-            to_copy_values[weighing.id] = {
-                'netweight': weighing.not_assigned_weight}
+        assigned_weights = cls.get_assigned_weights(weighings)
+        not_assigned_weights = {
+            w.id: (w.netweight or 0) - assigned_weights[w.id]
+            for w in weighings}
         cls.copy(weighings, default={
-                            'netweight': lambda d: (
-                                to_copy_values[d['id']]['netweight']),
-                            'weight': lambda d: (
-                                to_copy_values[d['id']]['netweight']),
-                            })
+                'netweight': lambda d: not_assigned_weights[d['id']],
+                'weight': lambda d: not_assigned_weights[d['id']],
+                })
+        # Group the originals by assigned weight to limit the updates
+        to_write = defaultdict(list)
         for weighing in weighings:
-            weighing.forced_analysis = True
-            weighing.netweight -= weighing.not_assigned_weight
-        cls.save(weighings)
-        cls.analysis(weighings)
+            to_write[assigned_weights[weighing.id]].append(weighing)
+        args = []
+        for netweight, records in to_write.items():
+            args.extend((records, {
+                        'forced_analysis': True,
+                        'netweight': netweight,
+                        }))
+        if args:
+            cls.write(*args)
+        cls.analysis(cls.browse(weighings))
 
     def create_quality_test(self):
         pool = Pool()
@@ -444,6 +768,7 @@ class Weighing(Workflow, ModelSQL, ModelView):
         pass
 
     @classmethod
+    @queued_transition
     @Workflow.transition('done')
     def do(cls, weighings):
         pool = Pool()
@@ -457,9 +782,32 @@ class Weighing(Workflow, ModelSQL, ModelView):
             type='wizard')
         Move = pool.get('stock.move')
 
-        default_invoice_line_values = InvoiceLine.default_get(
-            InvoiceLine._fields.keys(), with_rec_name=False)
-        invoice_line = InvoiceLine(**default_invoice_line_values)
+        company = Company(context['company'])
+
+        contract_price_lists = ContractProductPriceListTypePriceList.search([
+                ('contract', 'in', list({
+                            w.purchase_contract.id for w in weighings})),
+                ], order=[('id', 'DESC')])
+        price_lists = {}
+        # Search in reverse order to keep the first price list of the contract
+        for record in contract_price_lists:
+            key = (record.contract.id,
+                record.price_list_type.id if record.price_list_type else None)
+            price_lists[key] = record.price_list
+
+        unit_prices = {}
+
+        def get_unit_price(product, price_list, quantity):
+            key = (product.id, price_list.id if price_list else None,
+                quantity)
+            if key not in unit_prices:
+                if price_list:
+                    unit_prices[key] = price_list.compute(
+                        product, quantity, product.template.default_uom)
+                else:
+                    unit_prices[key] = Product.get_purchase_price(
+                        [product], abs(quantity))[product.id]
+            return unit_prices[key]
 
         to_save = []
         to_save_moves = []
@@ -467,39 +815,25 @@ class Weighing(Workflow, ModelSQL, ModelView):
         for weighing in weighings:
             cost_price = Decimal(0)
             for beneficiary in weighing.beneficiaries:
-                price_list = ContractProductPriceListTypePriceList.search([
-                        ('contract', '=', weighing.purchase_contract),
-                        ('price_list_type', '=',
-                            beneficiary.product_price_list_type),
-                        ])
+                price_list_type = beneficiary.product_price_list_type
+                price_list = price_lists.get((weighing.purchase_contract.id,
+                        price_list_type.id if price_list_type else None))
 
                 invoice_line = InvoiceLine()
                 invoice_line.type = 'line'
                 invoice_line.invoice_type = 'in'
                 invoice_line.party = beneficiary.party
-                invoice_line.currency = (
-                    Company(context['company']).currency)
-                invoice_line.company = Company(context['company'])
+                invoice_line.currency = company.currency
+                invoice_line.company = company
                 invoice_line.description = ''
                 invoice_line.product = weighing.product_created
                 invoice_line.on_change_product()
                 invoice_line.quantity = weighing.netweight or 0
-                invoice_line.product_price_list_type = (
-                    beneficiary.product_price_list_type)
+                invoice_line.product_price_list_type = price_list_type
                 invoice_line.origin = weighing
 
-                unit_price = Product.get_purchase_price(
-                    [weighing.product_created],
-                    abs(weighing.netweight or 0))[
-                        weighing.product_created.id]
-                if price_list:
-                    if price_list[0].price_list:
-                        price_list = price_list[0].price_list
-                    unit_price = price_list.compute(
-                        weighing.product_created,
-                        weighing.netweight or 0,
-                        weighing.product_created.template.default_uom)
-                    unit_price = unit_price
+                unit_price = get_unit_price(weighing.product_created,
+                    price_list, weighing.netweight or 0)
                 invoice_line.unit_price = unit_price
                 cost_price += unit_price
                 to_save.append(invoice_line)
@@ -509,51 +843,62 @@ class Weighing(Workflow, ModelSQL, ModelView):
             weighing.product_created.cost_price = cost_price
             to_save_moves.append(weighing.inventory_move)
             to_recompute_products.append(weighing.product_created)
-            Product.save([weighing.product_created])
 
+        InvoiceLine.save(to_save)
+        Move.save(to_save_moves)
+        Product.save(to_recompute_products)
+
+        if to_recompute_products:
             session_id, _, _ = RecomputeCostPrice.create()
             with Transaction().set_context(active_model='product.product',
-                    active_ids=[weighing.product_created.id]):
+                    active_ids=[p.id for p in to_recompute_products]):
                 recompute_cost_price = RecomputeCostPrice(session_id)
                 default_values = recompute_cost_price.default_start({})
                 recompute_cost_price.start.from_ = default_values['from_']
                 recompute_cost_price.transition_recompute()
 
-        InvoiceLine.save(to_save)
-        Move.save(to_save_moves)
-
     @classmethod
+    @queued_transition
     @Workflow.transition('processing')
     def process(cls, weighings):
-        Beneficiary = Pool().get('agronomics.beneficiary')
-        to_save = []
+        pool = Pool()
+        Beneficiary = pool.get('agronomics.beneficiary')
+        Parcel = pool.get('agronomics.parcel')
 
-        for weighing in weighings:
-            if weighing.beneficiaries:
-                Beneficiary.delete([x for x in weighing.beneficiaries])
+        Beneficiary.delete([b for w in weighings for b in w.beneficiaries])
 
+        parcels = Parcel.find_by_plantation_crop(
+            (wp.plantation.id, w.crop.id)
+            for w in weighings for wp in w.plantations)
+        # The beneficiaries are copied from the parcel of the first
+        # plantation like the other values of the weighing
+        weighing2parcel = {}
+        for weighing in weighings:
             # Check if all plantations has a parcel in the weighing's crop
-            for plantation in weighing.plantations:
-                plantation = plantation.plantation
-                for parcel in plantation.parcels:
-                    if parcel.crop == weighing.crop:
-                        break
-                else:
-                    raise UserError(gettext('agronomics.msg_parcel_without_current_crop',
-                        weighing=weighing.rec_name, plantation=plantation.code))
-
-            if not parcel:
-                continue
-
-            for ben in parcel.beneficiaries:
-                b = Beneficiary()
-                b.party = ben.party
-                b.weighing = weighing
-                b.product_price_list_type = ben.product_price_list_type
-                to_save.append(b)
-
-        if to_save:
-            Beneficiary.save(to_save)
+            for wp in weighing.plantations:
+                parcel = parcels[(wp.plantation.id, weighing.crop.id)]
+                if not parcel:
+                    raise UserError(gettext(
+                            'agronomics.msg_parcel_without_current_crop',
+                            weighing=weighing.rec_name,
+                            plantation=wp.plantation.code))
+                weighing2parcel.setdefault(weighing, parcel)
+
+        beneficiaries = defaultdict(list)
+        for beneficiary in Beneficiary.search([
+                    ('parcel', 'in', list(weighing2parcel.values())),
+                    ]):
+            beneficiaries[beneficiary.parcel].append(beneficiary)
+
+        Beneficiary.create([{
+                    'party': b.party.id,
+                    'weighing': weighing.id,
+                    'product_price_list_type': (
+                        b.product_price_list_type.id
+                        if b.product_price_list_type else None),
+                    }
+                for weighing, parcel in weighing2parcel.items()
+                for b in beneficiaries[parcel]])
 
     @classmethod
     @Workflow.transition('cancel')
@@ -561,20 +906,412 @@ class Weighing(Workflow, ModelSQL, ModelView):
         pass
 
     @classmethod
-    def set_number(cls, weighing_center):
+    def set_numbers(cls, weighing_center, count):
         WeighingCenter = Pool().get('agronomics.weighing.center')
         weighing_center = WeighingCenter(weighing_center)
-        return (weighing_center.weighing_sequence and
-            weighing_center.weighing_sequence.get())
+        if not weighing_center.weighing_sequence:
+            return [None] * count
+        if weighing_center.numbering == 'block':
+            return weighing_center.reserve_numbers(count)
+        return list(weighing_center.weighing_sequence.get_many(count))
 
     @classmethod
     def create(cls, vlist):
+        WeighingCenter = Pool().get('agronomics.weighing.center')
         vlist = [v.copy() for v in vlist]
+        to_number = defaultdict(list)
         for values in vlist:
-            if not values.get('number'):
-                values['number'] = cls.set_number(values.get('weighing_center'))
+            if not values.get('number') and values.get('weighing_center'):
+                to_number[values['weighing_center']].append(values)
+        for weighing_center, center_vlist in to_number.items():
+            numbering = WeighingCenter(weighing_center).numbering
+            numbers = cls.set_numbers(weighing_center, len(center_vlist))
+            for values, number in zip(center_vlist, numbers):
+                values['number'] = number
+                values['block_number'] = (
+                    numbering == 'block' and number is not None)
         return super().create(vlist)
 
+    @classmethod
+    def import_tickets(cls, tickets):
+        """Create weighings from a batch of weighbridge tickets
+
+        Each ticket is a dictionary with the weighing_center id, the
+        weighing_date, the crop code (found from the date when missing), the
+        list of plantation codes and the weight, netweight and grade values.
+        Product, variety, table, ecological, denominations of origin and
+        purchase contract are filled from the parcel of the first plantation
+        like on_change_plantations does.
+
+        Returns for each ticket a dictionary with the created weighing id or
+        the error message of the ticket.
+        """
+        pool = Pool()
+        WeighingCenter = pool.get('agronomics.weighing.center')
+        Crop = pool.get('agronomics.crop')
+        Plantation = pool.get('agronomics.plantation')
+        Parcel = pool.get('agronomics.parcel')
+        ContractLine = pool.get('agronomics.contract.line')
+        Date = pool.get('ir.date')
+
+        if not tickets:
+            return []
+
+        today = Date.today()
+        center_ids = {t.get('weighing_center') for t in tickets}
+        centers = {c.id for c in WeighingCenter.search([
+                    ('id', 'in', [c for c in center_ids if c]),
+                    ])}
+        dates = {t.get('weighing_date') or today for t in tickets}
+        crop_codes = {t['crop'] for t in tickets if t.get('crop')}
+        crops = Crop.search(['OR',
+                ('code', 'in', list(crop_codes)),
+                [
+                    ('start_date', '<=', max(dates)),
+                    ('end_date', '>=', min(dates)),
+                    ],
+                ])
+        code2crop = {c.code: c for c in crops}
+        plantation_codes = {c for t in tickets
+            for c in t.get('plantations') or []}
+        code2plantation = {p.code: p for p in Plantation.search([
+                    ('code', 'in', list(plantation_codes)),
+                    ])}
+        parcels = Parcel.find_by_plantation_crop(
+            (p.id, c.id) for p in code2plantation.values() for c in crops)
+        contracts = {}
+        for line in ContractLine.search([
+                    ('parcel', 'in', [p for p in parcels.values() if p]),
+                    ('contract.state', '=', 'active'),
+                    ], order=[('id', 'DESC')]):
+            if line.contract.party == line.parcel.plantation.party:
+                contracts[line.parcel.id] = line.contract
+
+        results = [None] * len(tickets)
+        to_create, indexes = [], []
+        for index, ticket in enumerate(tickets):
+            number = index + 1
+            weighing_date = ticket.get('weighing_date') or today
+            if ticket.get('weighing_center') not in centers:
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_weighing_center',
+                        ticket=number,
+                        center=ticket.get('weighing_center'))}
+                continue
+            missing = [n for n in ['weight', 'netweight', 'grade']
+                if ticket.get(n) is None]
+            if missing:
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_required',
+                        ticket=number,
+                        field=cls.__names__(missing[0])['field'])}
+                continue
+            weight, netweight = ticket['weight'], ticket['netweight']
+            if (weight < 0
+                    or (netweight and not (0 < netweight <= weight))):
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_netweight',
+                        ticket=number, weight=weight, netweight=netweight)}
+                continue
+            if ticket.get('crop'):
+                crop = code2crop.get(ticket['crop'])
+            else:
+                crop = Crop.find_by_date(weighing_date)
+            if not crop:
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_crop',
+                        ticket=number)}
+                continue
+            if not (crop.start_date <= weighing_date <= crop.end_date):
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_crop_date',
+                        ticket=number, crop=crop.rec_name,
+                        date=weighing_date)}
+                continue
+            if len(ticket.get('plantations') or []) > cls.plantations.size:
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_plantations_size',
+                        ticket=number, size=cls.plantations.size)}
+                continue
+            plantations, ticket_parcels = [], []
+            for code in ticket.get('plantations') or []:
+                plantation = code2plantation.get(code)
+                if not plantation:
+                    results[index] = {'error': gettext(
+                            'agronomics.msg_weighing_ticket_plantation',
+                            ticket=number, plantation=code)}
+                    break
+                parcel = parcels.get((plantation.id, crop.id))
+                if not parcel:
+                    results[index] = {'error': gettext(
+                            'agronomics.msg_weighing_ticket_parcel',
+                            ticket=number, plantation=code,
+                            crop=crop.rec_name)}
+                    break
+                plantations.append(plantation)
+                ticket_parcels.append(parcel)
+            if results[index]:
+                continue
+            if not ticket_parcels:
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_no_plantation',
+                        ticket=number)}
+                continue
+            parcel = ticket_parcels[0]
+            if not parcel.product:
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_product',
+                        ticket=number, parcel=parcel.rec_name)}
+                continue
+            for plantation, other in zip(plantations, ticket_parcels):
+                if (other.product != parcel.product
+                        or other.variety != parcel.variety):
+                    results[index] = {'error': gettext(
+                            'agronomics.msg_weighing_ticket_variety',
+                            ticket=number, plantation=plantation.code)}
+                    break
+            if results[index]:
+                continue
+            contract = contracts.get(parcel.id)
+            if not contract:
+                results[index] = {'error': gettext(
+                        'agronomics.msg_weighing_ticket_contract',
+                        ticket=number, parcel=parcel.rec_name)}
+                continue
+
+            values = {
+                'weighing_center': ticket['weighing_center'],
+                'weighing_date': weighing_date,
+                'crop': crop.id,
+                'purchase_contract': contract.id,
+                'product': parcel.product.id,
+                'variety': parcel.variety.id,
+                'table': parcel.table,
+                'ecological': (ticket.get('ecological')
+                    or parcel.ecological.id),
+                'weight': ticket.get('weight'),
+                'netweight': ticket.get('netweight'),
+                'grade': ticket.get('grade'),
+                'plantations': [('create', [{
+                                'plantation': p.id,
+                                'sequence': i,
+                                } for i, p in enumerate(plantations)])],
+                }
+            if ticket.get('number'):
+                values['number'] = ticket['number']
+            if not parcel.table:
+                values['denomination_origin'] = [('add',
+                        [d.id for d in parcel.denomination_origin])]
+            to_create.append(values)
+            indexes.append(index)
+
+        weighings = cls.create(to_create)
+        for index, weighing in zip(indexes, weighings):
+            results[index] = {'id': weighing.id}
+        return results
+
+    @classmethod
+    def set_scale_weights(cls, weights):
+        """Set the stable weights read from the scales of weighing centers
+
+        weights is a dictionary of weighing center id and weight.
+        The weight is set on the last draft weighing of the center: as its
+        weight and net weight when it has no weight yet, or as its tara when
+        the net weight is still the weight.
+
+        Returns the ids of the updated weighings.
+        """
+        weighing = cls.__table__()
+        # The keys are strings when called through RPC
+        weights = {int(c): w for c, w in weights.items()}
+        if not weights:
+            return []
+        last_weighings = cls.search([
+                ('id', 'in', weighing.select(Max(weighing.id),
+                        where=(weighing.state == 'draft')
+                        & weighing.weighing_center.in_(list(weights)),
+                        group_by=weighing.weighing_center)),
+                ])
+        to_write = []
+        for last_weighing in last_weighings:
+            weight = weights[last_weighing.weighing_center.id]
+            if not weight or weight <= 0:
+                continue
+            if not last_weighing.weight:
+                values = {
+                    'weight': weight,
+                    'netweight': weight,
+                    }
+            elif (last_weighing.netweight == last_weighing.weight
+                    and weight < last_weighing.weight):
+                values = {
+                    'netweight': last_weighing.weight - weight,
+                    }
+            else:
+                continue
+            to_write.extend(([last_weighing], values))
+        if to_write:
+            cls.write(*to_write)
+        return [r.id for records in to_write[::2] for r in records]
+
+    @classmethod
+    def export_weighings(cls, file, domain=None, rows='weighing',
+            format='csv', chunk_size=1000):
+        """Write the weighings matching the domain to the text file
+
+        The weighings are read by chunks of ids so the memory does not grow
+        with the number of exported weighings. The rows are 'weighing',
+        'parcel' for the weighing-parcel rows or 'beneficiary' for the
+        beneficiary rows of the weighings.
+        The format is 'csv' or 'jsonl'.
+        """
+        assert format in {'csv', 'jsonl'}
+        columns, read_rows = {
+            'weighing': cls._export_weighing_rows,
+            'parcel': cls._export_parcel_rows,
+            'beneficiary': cls._export_beneficiary_rows,
+            }[rows]()
+        if format == 'csv':
+            writer = csv.writer(file)
+            writer.writerow(columns)
+        last_id = 0
+        while True:
+            page = [('id', '>', last_id)]
+            if domain:
+                page = [domain, page]
+            ids = [w.id for w in cls.search(page,
+                    order=[('id', 'ASC')], limit=chunk_size)]
+            if not ids:
+                break
+            last_id = ids[-1]
+            rows = read_rows(ids)
+            if format == 'csv':
+                writer.writerows(rows)
+            else:
+                for row in rows:
+                    file.write(json.dumps(dict(zip(columns, row)),
+                            default=str) + '\n')
+
+    @classmethod
+    def _export_weighing_rows(cls):
+        pool = Pool()
+        Center = pool.get('agronomics.weighing.center')
+        Crop = pool.get('agronomics.crop')
+        Template = pool.get('product.template')
+        Taxon = pool.get('product.taxon')
+        Ecological = pool.get('agronomics.ecological')
+        WeighingPlantation = pool.get(
+            'agronomics.weighing-agronomics.plantation')
+        Plantation = pool.get('agronomics.plantation')
+        weighing = cls.__table__()
+        center = Center.__table__()
+        crop = Crop.__table__()
+        template = Template.__table__()
+        taxon = Taxon.__table__()
+        ecological = Ecological.__table__()
+        weighing_plantation = WeighingPlantation.__table__()
+        plantation = Plantation.__table__()
+        cursor = Transaction().connection.cursor()
+
+        columns = ['id', 'number', 'weighing_date', 'weighing_center', 'crop',
+            'product', 'variety', 'ecological', 'table', 'weight',
+            'netweight', 'grade', 'state', 'plantations',
+            'denomination_origin']
+
+        query = (weighing
+            .join(center, 'LEFT',
+                condition=weighing.weighing_center == center.id)
+            .join(crop, 'LEFT', condition=weighing.crop == crop.id)
+            .join(template, 'LEFT', condition=weighing.product == template.id)
+            .join(taxon, 'LEFT', condition=weighing.variety == taxon.id)
+            .join(ecological, 'LEFT',
+                condition=weighing.ecological == ecological.id)
+            .select(weighing.id, weighing.number, weighing.weighing_date,
+                center.name, crop.code, template.name, taxon.name,
+                ecological.name, weighing.table, weighing.weight,
+                weighing.netweight, weighing.grade, weighing.state,
+                order_by=weighing.id))
+
+        def read_rows(ids):
+            plantations = defaultdict(list)
+            cursor.execute(*weighing_plantation.join(plantation,
+                    condition=weighing_plantation.plantation == plantation.id
+                    ).select(weighing_plantation.weighing, plantation.code,
+                    where=reduce_ids(weighing_plantation.weighing, ids),
+                    order_by=[weighing_plantation.sequence,
+                        weighing_plantation.id]))
+            for weighing_id, code in cursor:
+                plantations[weighing_id].append(code)
+            dos = cls.get_all_do(cls.browse(ids), 'all_do')
+
+            query.where = reduce_ids(weighing.id, ids)
+            cursor.execute(*query)
+            return [row + (",".join(plantations[row[0]]), dos[row[0]])
+                for row in cursor]
+        return columns, read_rows
+
+    @classmethod
+    def _export_parcel_rows(cls):
+        pool = Pool()
+        WeighingParcel = pool.get('agronomics.weighing-agronomics.parcel')
+        Parcel = pool.get('agronomics.parcel')
+        Plantation = pool.get('agronomics.plantation')
+        Crop = pool.get('agronomics.crop')
+        weighing = cls.__table__()
+        weighing_parcel = WeighingParcel.__table__()
+        parcel = Parcel.__table__()
+        plantation = Plantation.__table__()
+        crop = Crop.__table__()
+        cursor = Transaction().connection.cursor()
+
+        columns = ['id', 'weighing', 'number', 'parcel', 'plantation', 'crop',
+            'table', 'netweight']
+
+        query = (weighing_parcel
+            .join(weighing, condition=weighing_parcel.weighing == weighing.id)
+            .join(parcel, 'LEFT',
+                condition=weighing_parcel.parcel == parcel.id)
+            .join(plantation, 'LEFT',
+                condition=parcel.plantation == plantation.id)
+            .join(crop, 'LEFT', condition=parcel.crop == crop.id)
+            .select(weighing_parcel.id, weighing.id, weighing.number,
+                parcel.id, plantation.code, crop.code,
+                weighing_parcel.table, weighing_parcel.netweight,
+                order_by=[weighing.id, weighing_parcel.id]))
+
+        def read_rows(ids):
+            query.where = reduce_ids(weighing_parcel.weighing, ids)
+            cursor.execute(*query)
+            return cursor.fetchall()
+        return columns, read_rows
+
+    @classmethod
+    def _export_beneficiary_rows(cls):
+        pool = Pool()
+        Beneficiary = pool.get('agronomics.beneficiary')
+        Party = pool.get('party.party')
+        weighing = cls.__table__()
+        beneficiary = Beneficiary.__table__()
+        party = Party.__table__()
+        cursor = Transaction().connection.cursor()
+
+        columns = ['id', 'weighing', 'number', 'party', 'party_code',
+            'party_name', 'product_price_list_type']
+
+        query = (beneficiary
+            .join(weighing, condition=beneficiary.weighing == weighing.id)
+            .join(party, 'LEFT', condition=beneficiary.party == party.id)
+            .select(beneficiary.id, weighing.id, weighing.number,
+                party.id, party.code, party.name,
+                beneficiary.product_price_list_type,
+                order_by=[weighing.id, beneficiary.id]))
+
+        def read_rows(ids):
+            query.where = reduce_ids(beneficiary.weighing, ids)
+            cursor.execute(*query)
+            return cursor.fetchall()
+        return columns, read_rows
+
     @classmethod
     def copy(cls, weighings, default=None):
         if default is None:
@@ -585,11 +1322,92 @@ class Weighing(Workflow, ModelSQL, ModelView):
         default.setdefault('beneficiaries_invoices_line', None)
         default.setdefault('product_created', None)
         default.setdefault('number', None)
+        default.setdefault('provisional_number', None)
+        default.setdefault('block_number', False)
         default.setdefault('parcels', None)
         default.setdefault('inventory_move', None)
+        default.setdefault('queue_state', None)
+        default.setdefault('queue_error', None)
         return super().copy(weighings, default=default)
 
 
+class Cron(metaclass=PoolMeta):
+    __name__ = 'ir.cron'
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls.method.selection.append(
+            ('agronomics.weighing.center|close_numbers',
+                "Close Weighing Numbers"),
+            )
+
+
+class WeighingDailySummary(ModelSQL, ModelView):
+    "Weighing Daily Summary"
+    __name__ = 'agronomics.weighing.daily_summary'
+
+    weighing_center = fields.Many2One('agronomics.weighing.center',
+        "Weighing Center", readonly=True)
+    crop = fields.Many2One('agronomics.crop', "Crop", readonly=True)
+    weighing_date = fields.Date("Weighing Date", readonly=True)
+    variety = fields.Many2One('product.taxon', "Variety", readonly=True)
+    ecological = fields.Many2One('agronomics.ecological', "Ecological",
+        readonly=True)
+    state = fields.Selection([
+                ('draft', "Draft"),
+                ('processing', "Processing"),
+                ('distributed', "Distributed"),
+                ('in_analysis', "In Analysis"),
+                ('done', "Done"),
+                ('cancelled', "Cancelled"),
+                ], "State", readonly=True)
+    weighings = fields.Integer("Weighings", readonly=True)
+    weight = fields.Float("Weight", readonly=True)
+    netweight = fields.Float("Net Weight", readonly=True)
+    grade = fields.Float("Grade", digits=(16, 1), readonly=True,
+        help="The average grade weighted by the net weight.")
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        cls._order = [
+            ('weighing_date', 'DESC NULLS FIRST'),
+            ('weighing_center', 'ASC'),
+            ('id', 'DESC'),
+            ]
+
+    @classmethod
+    def table_query(cls):
+        pool = Pool()
+        Weighing = pool.get('agronomics.weighing')
+        weighing = Weighing.__table__()
+
+        netweight = Sum(Coalesce(weighing.netweight, 0))
+        return weighing.select(
+            Min(weighing.id).as_('id'),
+            Literal(0).as_('create_uid'),
+            CurrentTimestamp().as_('create_date'),
+            cls.write_uid.sql_cast(Literal(Null)).as_('write_uid'),
+            cls.write_date.sql_cast(Literal(Null)).as_('write_date'),
+            weighing.weighing_center.as_('weighing_center'),
+            weighing.crop.as_('crop'),
+            weighing.weighing_date.as_('weighing_date'),
+            weighing.variety.as_('variety'),
+            weighing.ecological.as_('ecological'),
+            weighing.state.as_('state'),
+            Count(Literal('*')).as_('weighings'),
+            Sum(Coalesce(weighing.weight, 0)).as_('weight'),
+            netweight.as_('netweight'),
+            (Sum(Coalesce(weighing.netweight, 0) * weighing.grade)
+                / NullIf(netweight, 0)).as_('grade'),
+            group_by=[
+                weighing.weighing_center, weighing.crop,
+                weighing.weighing_date, weighing.variety,
+                weighing.ecological, weighing.state,
+                ])
+
+
 class WeighingDo(ModelSQL):
     'Weighing - Denomination Origin'
     __name__ = 'agronomics.weighing-agronomics.do'
@@ -637,3 +1455,42 @@ class WeighingParcel(ModelSQL, ModelView):
     parcel = fields.Many2One('agronomics.parcel', 'Parcel')
     netweight = fields.Float('Net Weight')
     table = fields.Boolean('Table')
+
+    @classmethod
+    def __setup__(cls):
+        super().__setup__()
+        t = cls.__table__()
+        cls._sql_indexes.add(
+            Index(t,
+                (t.parcel, Index.Equality()),
+                (t.table, Index.Equality())))
+
+    @classmethod
+    def on_modification(cls, mode, records, field_names=None):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        super().on_modification(mode, records, field_names=field_names)
+        if (mode == 'create'
+                or (mode == 'write' and {
+                        'parcel', 'netweight', 'table'} & set(field_names))):
+            HarvestLedger.update_parcels(
+                [r.parcel.id for r in records if r.parcel])
+
+    @classmethod
+    def on_write(cls, records, values):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        callbacks = super().on_write(records, values)
+        if 'parcel' in values:
+            parcel_ids = [r.parcel.id for r in records if r.parcel]
+            callbacks.append(lambda: HarvestLedger.update_parcels(parcel_ids))
+        return callbacks
+
+    @classmethod
+    def on_delete(cls, records):
+        pool = Pool()
+        HarvestLedger = pool.get('agronomics.parcel.harvest_ledger')
+        callbacks = super().on_delete(records)
+        parcel_ids = [r.parcel.id for r in records if r.parcel]
+        callbacks.append(lambda: HarvestLedger.update_parcels(parcel_ids))
+        return callbacks